@@ -0,0 +1,62 @@
+"""
+Startup benchmark of the stem CLI: runs 'stem structure' on a small workspace under
+python -X importtime and checks the total import time and that runners and codecs
+(asyncio, multiprocessing, numpy, h5py, protobuf) are not loaded.
+
+Usage: python benchmarks/cli_startup.py [TARGET_MS]
+"""
+import subprocess
+import sys
+import tempfile
+from pathlib import Path
+
+CLI = Path(__file__).resolve().parent.parent / 'stem' / 'cli_main.py'
+TARGET_MS = 100.0
+FORBIDDEN = ('asyncio', 'multiprocessing', 'concurrent.futures', 'numpy', 'h5py', 'google.protobuf', 'task_runner')
+
+WORKSPACE = '''
+from task import task, data
+
+@data
+def source(meta):
+    return 1
+
+@task
+def double(meta, source):
+    return 2 * source
+'''
+
+
+def import_times(workspace: Path) -> dict[str, int]:
+    process = subprocess.run(
+        [sys.executable, '-X', 'importtime', str(CLI), '-w', str(workspace), 'structure'],
+        capture_output=True, text=True, check=True,
+    )
+    times = {}
+    for line in process.stderr.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        self_us, _, name = line[len('import time:'):].split('|')
+        times[name.strip()] = int(self_us)
+    return times
+
+
+def main():
+    target_ms = float(sys.argv[1]) if len(sys.argv) > 1 else TARGET_MS
+    with tempfile.TemporaryDirectory() as directory:
+        workspace = Path(directory) / 'ws.py'
+        workspace.write_text(WORKSPACE)
+        times = import_times(workspace)
+
+    total_ms = sum(times.values()) / 1000
+    print(f"{len(times)} modules imported in {total_ms:.1f} ms (target {target_ms:.1f} ms)")
+    for name, us in sorted(times.items(), key=lambda item: item[1], reverse=True)[:10]:
+        print(f"{us / 1000:>8.2f} ms  {name}")
+
+    loaded = [name for name in times if name.startswith(FORBIDDEN)]
+    assert not loaded, f"heavy modules loaded by 'stem structure': {loaded}"
+    assert total_ms < target_ms, f"'stem structure' imports take {total_ms:.1f} ms > {target_ms:.1f} ms"
+
+
+if __name__ == '__main__':
+    main()
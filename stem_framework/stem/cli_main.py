@@ -1,12 +1,18 @@
 import argparse
 import importlib.util
-import json
-from pathlib import Path
+import os
 import sys
+from typing import Optional
 
-from stem.task_master import TaskMaster, TaskStatus
+from workspace import IWorkspace, TaskPath
 
-from stem.workspace import IWorkspace, TaskPath
+#runners are imported by name only for 'run', so 'structure' never loads them
+RUNNERS = {
+    'simple': 'SimpleRunner',
+    'parallel': 'ParallelRunner',
+    'processing': 'ProcessingRunner',
+    'async': 'AsyncRunner',
+}
 
 def create_parser() -> argparse.ArgumentParser:
     parser = argparse.ArgumentParser(description = 'Run tasks in workspace')
@@ -22,6 +28,46 @@ def create_parser() -> argparse.ArgumentParser:
         '-m', '--meta',
         help = 'Metadata for task or path to file with metadata in JSON format'
     )
+    subparser_run.add_argument(
+        '-r', '--runner', choices = RUNNERS, default = 'simple',
+        help = 'Task runner (default: simple)'
+    )
+    subparser_run.add_argument(
+        '--no-cache', action = 'store_true',
+        help = 'Do not read or write the persistent result cache'
+    )
+    subparser_run.add_argument(
+        '--refresh', metavar = 'TASKPATH', action = 'append', default = [],
+        help = 'Recompute task ignoring its cached result (can be repeated)'
+    )
+    subparser_run.add_argument(
+        '--profile', action = 'store_true',
+        help = 'Print per-task execution profile to stderr'
+    )
+    subparser_run.add_argument(
+        '--profile-trace', metavar = 'FILE',
+        help = 'Write per-task execution profile in Chrome trace-event JSON format'
+    )
+    subparser_run.add_argument(
+        '--cache-dir',
+        help = 'Directory of the result cache (default: $STEM_CACHE_DIR or ~/.cache/stem)'
+    )
+    subparser_run.add_argument(
+        '-d', '--daemon', action = 'store_true',
+        help = 'Send the run to a stem daemon started by "stem serve"'
+    )
+    subparser_run.add_argument(
+        '--socket',
+        help = 'Unix socket of the daemon (default: $STEM_SOCKET, $XDG_RUNTIME_DIR/stem.sock or /tmp/stem-<uid>.sock)'
+    )
+
+    subparser_serve = subparsers.add_parser(
+        'serve', help = 'Start a daemon keeping workspaces, plans and caches loaded')
+    subparser_serve.set_defaults(func = serve)
+    subparser_serve.add_argument(
+        '--socket',
+        help = 'Unix socket to listen on (default: $STEM_SOCKET, $XDG_RUNTIME_DIR/stem.sock or /tmp/stem-<uid>.sock)'
+    )
 
     parser.add_argument(
         '-w', '--workspace',
@@ -31,9 +77,8 @@ def create_parser() -> argparse.ArgumentParser:
 
     return parser
 
-def get_workspace(args: argparse.Namespace):
-    file_path = args.workspace
-    module_name = Path(file_path).stem
+def load_workspace(file_path: str) -> IWorkspace:
+    module_name = os.path.splitext(os.path.basename(file_path))[0]
 
     spec = importlib.util.spec_from_file_location(module_name, file_path)
     if spec != None and spec.loader != None:
@@ -46,6 +91,10 @@ def get_workspace(args: argparse.Namespace):
     return IWorkspace.module_workspace(module)
 
 
+def get_workspace(args: argparse.Namespace):
+    return load_workspace(args.workspace)
+
+
 def print_structure(args: argparse.Namespace):
 
     def pretty(d, indent=0):
@@ -60,25 +109,80 @@ def print_structure(args: argparse.Namespace):
     pretty(workspace.structure())
 
 
-def task_run(args: argparse.Namespace):
-    workspace = get_workspace(args)
+def get_runner(name: str):
+    module = importlib.import_module('task_runner')
+    return getattr(module, RUNNERS[name])()
+
+
+def load_meta(meta: Optional[str]) -> dict:
+    import json
+    if meta is None:
+        return {}
+    try:
+        return json.loads(meta)
+    except json.JSONDecodeError:
+        with open(meta) as metafile:
+            return json.load(metafile)
+
+
+def make_task_master(args: argparse.Namespace, workspace: IWorkspace, incremental: bool = False):
+    from task_master import TaskMaster
+
+    cache = None
+    if not args.no_cache:
+        from task_cache import ResultCache
+        refresh = []
+        for path in args.refresh:
+            refreshed = workspace.find_task(TaskPath(path))
+            if refreshed is None:
+                raise ValueError(f"task '{path}' was not found in workspace '{workspace.name}'")
+            refresh.append(refreshed)
+        cache_dir = ResultCache.default_path() if args.cache_dir is None else args.cache_dir
+        cache = ResultCache(cache_dir, refresh = refresh)
+
+    profiler = None
+    if args.profile or args.profile_trace:
+        from task_profiler import Profiler
+        profiler = Profiler()
+
+    return TaskMaster(get_runner(args.runner), cache = cache, incremental = incremental, profiler = profiler)
+
+
+def run_task(args: argparse.Namespace, workspace: IWorkspace, task_master, out = None, err = None):
+    from task_master import TaskStatus
+    out = sys.stdout if out is None else out
+    err = sys.stderr if err is None else err
+
     task = workspace.find_task(TaskPath(args.TASKPATH))
     if task is None:
         raise ValueError(f"task '{args.TASKPATH}' was not found in workspace '{workspace.name}'")
-    if args.meta is None:
-        meta = {}
-    else:
-        try:
-            meta = json.loads(args.meta)
-        except json.JSONDecodeError:
-            with open(args.meta) as metafile:
-                meta = json.load(metafile)
+    meta = load_meta(args.meta)
 
-    pre_res = TaskMaster().execute(meta, task, workspace)
+    pre_res = task_master.execute(meta, task, workspace)
     if pre_res.status == TaskStatus.CONTAINS_DATA:
-        print(pre_res.lazy_data())
+        print(pre_res.lazy_data(), file = out)
     else:
-        print(pre_res)
+        print(pre_res, file = out)
+
+    profiler = task_master.profiler
+    if args.profile:
+        print(profiler.report(), file = err)
+    if args.profile_trace:
+        profiler.write_chrome_trace(args.profile_trace)
+
+
+def task_run(args: argparse.Namespace):
+    if args.daemon:
+        from daemon import request_run
+        request_run(args)
+        return
+    workspace = get_workspace(args)
+    run_task(args, workspace, make_task_master(args, workspace))
+
+
+def serve(args: argparse.Namespace):
+    from daemon import StemDaemon
+    StemDaemon(args.socket, preload = [args.workspace]).serve_forever()
 
 
 def stem_cli_main():
@@ -88,4 +192,4 @@ def stem_cli_main():
 
 
 if __name__ == "__main__":
-    stem_cli_main()
\ No newline at end of file
+    stem_cli_main()
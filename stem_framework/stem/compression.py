@@ -0,0 +1,141 @@
+"""
+Compression of envelope data sections. Data is split into chunks compressed independently,
+so it can be decompressed as a stream or partially, for a byte range.
+
+Compressed section (big-endian):
+    FRAME                    chunk size, uncompressed length, number of chunks
+    compressed chunk sizes   number of chunks uint32
+    compressed chunks
+"""
+import array
+import lzma
+import struct
+import sys
+import zlib
+from dataclasses import dataclass
+from itertools import accumulate
+from typing import Callable, Iterator, Optional, Union
+
+FRAME = struct.Struct('>IQI')
+DEFAULT_CHUNK_SIZE = 1024*1024 # 1 Mb
+#reserved header byte of envelopes without a codec or a filter
+NONE = b'.'
+
+
+@dataclass(frozen=True)
+class Codec:
+    name: str
+    id: bytes # single byte stored in the envelope header
+    compress: Callable[[bytes], bytes]
+    decompress: Callable[[bytes], bytes]
+
+
+CODECS: dict[str, Codec] = {}
+_CODEC_IDS: dict[bytes, Codec] = {}
+
+
+def register_codec(codec: Codec):
+    if len(codec.id) != 1 or codec.id == NONE:
+        raise ValueError(f"codec id should be a single byte other than {NONE!r}")
+    if _CODEC_IDS.get(codec.id, codec).name != codec.name:
+        raise ValueError(f"codec id {codec.id!r} is already used by '{_CODEC_IDS[codec.id].name}'")
+    CODECS[codec.name] = codec
+    _CODEC_IDS[codec.id] = codec
+
+
+register_codec(Codec('zlib', b'z', zlib.compress, zlib.decompress))
+register_codec(Codec('lzma', b'x', lzma.compress, lzma.decompress))
+
+
+def get_codec(codec: Union[str, bytes, Codec]) -> Codec:
+    if isinstance(codec, Codec):
+        return codec
+    found = _CODEC_IDS.get(codec) if isinstance(codec, bytes) else CODECS.get(codec)
+    if found is None:
+        raise ValueError(f"Unknown codec {codec!r}")
+    return found
+
+
+def shuffle(chunk: memoryview, itemsize: int) -> bytes:
+    #groups i-th bytes of all items together: similar bytes of typed arrays compress better
+    if itemsize <= 1:
+        return bytes(chunk)
+    body = len(chunk) - len(chunk) % itemsize
+    return b''.join([bytes(chunk[i:body:itemsize]) for i in range(itemsize)] + [bytes(chunk[body:])])
+
+
+def unshuffle(chunk: bytes, itemsize: int) -> bytes:
+    if itemsize <= 1:
+        return chunk
+    count = len(chunk) // itemsize
+    body = count * itemsize
+    out = bytearray(len(chunk))
+    for i in range(itemsize):
+        out[i:body:itemsize] = chunk[i * count:(i + 1) * count]
+    out[body:] = chunk[body:]
+    return bytes(out)
+
+
+def compress(data: memoryview, codec: Codec, itemsize: int = 0,
+             chunk_size: int = DEFAULT_CHUNK_SIZE) -> list[memoryview]:
+    #compressed section as a list of buffers
+    if itemsize > 1:
+        #whole items per chunk, at least one
+        chunk_size = max(chunk_size - chunk_size % itemsize, itemsize)
+    chunks = [codec.compress(shuffle(data[start:start + chunk_size], itemsize))
+              for start in range(0, len(data), chunk_size)]
+    sizes = array.array('I', map(len, chunks))
+    if sys.byteorder == 'little':
+        sizes.byteswap()
+    frame = FRAME.pack(chunk_size, len(data), len(chunks))
+    return [memoryview(frame), memoryview(sizes).cast('B')] + [memoryview(c) for c in chunks]
+
+
+class CompressedData:
+    """
+    Read access to a compressed data section: chunks are decompressed only when needed.
+    """
+
+    def __init__(self, section: memoryview, codec: Codec, itemsize: int = 0):
+        self.section = section
+        self.codec = codec
+        self.itemsize = itemsize
+        self.chunk_size, self.length, count = FRAME.unpack(section[:FRAME.size])
+        sizes = array.array('I')
+        sizes.frombytes(section[FRAME.size:FRAME.size + 4 * count])
+        if sys.byteorder == 'little':
+            sizes.byteswap()
+        self._offsets = list(accumulate(sizes, initial=FRAME.size + 4 * count))
+
+    def __len__(self) -> int:
+        return self.length
+
+    @property
+    def chunk_count(self) -> int:
+        return len(self._offsets) - 1
+
+    def chunk(self, i: int) -> bytes:
+        compressed = self.section[self._offsets[i]:self._offsets[i + 1]]
+        return unshuffle(self.codec.decompress(compressed), self.itemsize)
+
+    def __iter__(self) -> Iterator[bytes]:
+        for i in range(self.chunk_count):
+            yield self.chunk(i)
+
+    def read(self, start: int = 0, stop: Optional[int] = None) -> bytes:
+        #decompresses only the chunks overlapping [start, stop)
+        stop = self.length if stop is None else min(stop, self.length)
+        if start >= stop:
+            return b''
+        first, last = start // self.chunk_size, (stop - 1) // self.chunk_size
+        data = b''.join(self.chunk(i) for i in range(first, last + 1))
+        offset = first * self.chunk_size
+        return data[start - offset:stop - offset]
+
+    def decompress(self) -> bytearray:
+        out = bytearray(self.length)
+        view = memoryview(out)
+        for i, chunk in enumerate(self):
+            start = i * self.chunk_size
+            view[start:start + len(chunk)] = chunk
+        return out
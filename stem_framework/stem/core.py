@@ -5,7 +5,7 @@ def pascal_case_to_snake_case(name: str) -> str:
     return '_'.join(
         sub('([A-Z][a-z]+)', r' \1',
         sub('([A-Z]+)', r' \1',
-        s.replace('-', ' '))).split()).lower()
+        name.replace('-', ' '))).split()).lower()
 
 class Dataclass(Protocol):
     __dataclass_fields__: Any
@@ -15,7 +15,7 @@ class Named():
     _name: Optional[str] = None
 
     @property
-    def name():
+    def name(self):
         if (self._name is not None):
             return self._name
         else:
@@ -0,0 +1,170 @@
+"""
+Persistent stem worker: "stem serve" keeps workspaces loaded, compiled task plans and result caches warm
+and executes "stem run --daemon" requests received over a Unix socket, one JSON line per request and reply.
+The daemon imports any workspace file it is sent, so the socket is accessible to its owner only.
+"""
+import argparse
+import io
+import json
+import os
+import signal
+import socket
+import socketserver
+import sys
+import traceback
+from typing import Optional, Iterable
+
+from cli_main import load_workspace, load_meta, get_runner, run_task
+from workspace import IWorkspace, TaskPath
+
+#options of "stem run" forwarded to the daemon
+RUN_OPTIONS = ('TASKPATH', 'meta', 'runner', 'no_cache', 'refresh', 'profile', 'profile_trace', 'cache_dir')
+
+
+def default_socket() -> str:
+    if 'STEM_SOCKET' in os.environ:
+        return os.environ['STEM_SOCKET']
+    #the runtime directory is private to the user, unlike /tmp
+    runtime = os.environ.get('XDG_RUNTIME_DIR')
+    if runtime:
+        return os.path.join(runtime, 'stem.sock')
+    return f"/tmp/stem-{os.getuid()}.sock"
+
+
+class StemDaemon:
+    """
+    Workspaces are reloaded when their file changes. A TaskMaster is kept per
+    (workspace, runner, cache directory) in incremental mode, so it keeps compiled
+    plans and the results of the previous run (with --no-cache only the plans);
+    requests are executed one at a time.
+    """
+
+    def __init__(self, socket_path: Optional[str] = None, preload: Iterable[str] = ()):
+        self.socket_path = default_socket() if socket_path is None else socket_path
+        self._workspaces: dict[str, tuple[float, IWorkspace]] = {}
+        self._caches = {}
+        self._masters = {}
+        for path in preload:
+            self.workspace(path)
+
+    def workspace(self, path: str) -> IWorkspace:
+        path = os.path.abspath(path)
+        mtime = os.stat(path).st_mtime
+        loaded = self._workspaces.get(path)
+        if loaded is not None and loaded[0] == mtime:
+            return loaded[1]
+        workspace = load_workspace(path)
+        self._workspaces[path] = (mtime, workspace)
+        #plans and in-memory results of the old module are stale
+        for key in [k for k in self._masters if k[0] == path]:
+            del self._masters[key]
+        return workspace
+
+    def result_cache(self, cache_dir: Optional[str]):
+        from task_cache import ResultCache
+        path = os.path.abspath(ResultCache.default_path() if cache_dir is None else cache_dir)
+        cache = self._caches.get(path)
+        if cache is None:
+            cache = self._caches[path] = ResultCache(path)
+        return cache
+
+    def task_master(self, path: str, args: argparse.Namespace):
+        from task_master import TaskMaster
+        cache = None if args.no_cache else self.result_cache(args.cache_dir)
+        key = (os.path.abspath(path), args.runner, None if cache is None else cache.path)
+        task_master = self._masters.get(key)
+        if task_master is None:
+            task_master = self._masters[key] = TaskMaster(get_runner(args.runner), cache = cache,
+                                                          incremental = cache is not None)
+        return task_master
+
+    def execute(self, request: dict) -> dict:
+        out, err = io.StringIO(), io.StringIO()
+        try:
+            args = argparse.Namespace(**{name: request.get(name) for name in RUN_OPTIONS})
+            args.refresh = args.refresh or []
+            workspace = self.workspace(request['workspace'])
+            task_master = self.task_master(request['workspace'], args)
+
+            refresh = []
+            for path in args.refresh:
+                refreshed = workspace.find_task(TaskPath(path))
+                if refreshed is None:
+                    raise ValueError(f"task '{path}' was not found in workspace '{workspace.name}'")
+                refresh.append(refreshed)
+            profiler = None
+            if args.profile or args.profile_trace:
+                from task_profiler import Profiler
+                profiler = Profiler()
+
+            task_master.profiler = task_master.task_runner.profiler = profiler
+            #refreshed tasks skip both the results of the previous run and the persistent cache
+            caches = [c for c in (task_master.incremental, task_master.cache) if c is not None]
+            for cache in caches:
+                cache.refresh = set(refresh)
+            try:
+                run_task(args, workspace, task_master, out, err)
+            finally:
+                task_master.profiler = task_master.task_runner.profiler = None
+                for cache in caches:
+                    cache.refresh = set()
+            status = 0
+        except Exception:
+            traceback.print_exc(file = err)
+            status = 1
+        return {'status': status, 'stdout': out.getvalue(), 'stderr': err.getvalue()}
+
+    def serve_forever(self):
+        daemon = self
+
+        class Handler(socketserver.StreamRequestHandler):
+            def handle(self):
+                for line in self.rfile:
+                    reply = daemon.execute(json.loads(line))
+                    self.wfile.write(json.dumps(reply).encode() + b'\n')
+                    self.wfile.flush()
+
+        if os.path.exists(self.socket_path):
+            os.unlink(self.socket_path)
+        #no window in which the socket exists with the default permissions
+        umask = os.umask(0o177)
+        try:
+            server = socketserver.UnixStreamServer(self.socket_path, Handler)
+        finally:
+            os.umask(umask)
+        os.chmod(self.socket_path, 0o600)
+        with server:
+            signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
+            print(f"stem daemon is listening on {self.socket_path}", file = sys.stderr)
+            try:
+                server.serve_forever()
+            except KeyboardInterrupt:
+                pass
+            finally:
+                os.unlink(self.socket_path)
+
+
+def send_request(request: dict, socket_path: Optional[str] = None) -> dict:
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        sock.connect(default_socket() if socket_path is None else socket_path)
+        with sock.makefile('rwb') as stream:
+            stream.write(json.dumps(request).encode() + b'\n')
+            stream.flush()
+            return json.loads(stream.readline())
+
+
+def request_run(args: argparse.Namespace):
+    request = {name: getattr(args, name) for name in RUN_OPTIONS}
+    #paths are relative to the client, meta file is read by the client
+    request['workspace'] = os.path.abspath(args.workspace)
+    request['meta'] = json.dumps(load_meta(args.meta))
+    if args.profile_trace:
+        request['profile_trace'] = os.path.abspath(args.profile_trace)
+    if args.cache_dir:
+        request['cache_dir'] = os.path.abspath(args.cache_dir)
+
+    reply = send_request(request, args.socket)
+    sys.stdout.write(reply['stdout'])
+    sys.stderr.write(reply['stderr'])
+    if reply['status'] != 0:
+        sys.exit(reply['status'])
@@ -1,14 +1,30 @@
 import array
+import json
 import mmap
-from asyncio import StreamReader, StreamWriter
-from io import RawIOBase, BufferedReader
+import os
+import struct
+from collections import deque
+from dataclasses import is_dataclass, asdict
+from io import RawIOBase, BufferedReader, BytesIO
+from itertools import islice
 from json import JSONEncoder
-from typing import Optional, Union, Any
+from typing import Optional, Union, Any, AsyncIterator, TYPE_CHECKING
 from .meta import Meta
+from .compression import Codec, CompressedData, DEFAULT_CHUNK_SIZE, NONE, compress, get_codec
+
+#asyncio is only needed by the async codec
+if TYPE_CHECKING:
+    from asyncio import StreamReader, StreamWriter
 
 
 Binary = Union[bytes, bytearray, memoryview, array.array, mmap.mmap]
 
+#'#~', format type, codec and shuffle item size (b'..' for raw data), meta length, data length
+HEADER = struct.Struct('>2s4s2sII')
+START = b'#~'
+TYPE = b'DF02'
+END = b'~#'
+
 
 class MetaEncoder(JSONEncoder):
 
@@ -21,66 +37,244 @@ class MetaEncoder(JSONEncoder):
             raise TypeError
 
 
+def _fileno(stream) -> Optional[int]:
+    try:
+        return stream.fileno()
+    except (AttributeError, OSError, ValueError):
+        return None
+
+
+def _readinto(stream, buffer: memoryview) -> int:
+    #fills buffer from a stream which may return less than requested
+    done = 0
+    while done < len(buffer):
+        n = stream.readinto(buffer[done:])
+        if not n:
+            break
+        done += n
+    return done
+
+
+def _iov_max() -> int:
+    #os.writev fails on more buffers than the system limit
+    try:
+        limit = os.sysconf('SC_IOV_MAX')
+    except (AttributeError, ValueError, OSError):
+        limit = -1
+    return limit if limit > 0 else 1024
+
+
+def _writev(fd: int, parts: list[memoryview]):
+    #os.writev may write only a part of the buffers
+    parts = deque(p for p in parts if len(p))
+    limit = _iov_max()
+    while parts:
+        written = os.writev(fd, list(islice(parts, limit)))
+        while parts and written >= len(parts[0]):
+            written -= len(parts[0])
+            parts.popleft()
+        if parts and written:
+            parts[0] = parts[0][written:]
+
+
+def write_parts(output, parts: list[memoryview]):
+    fd = _fileno(output)
+    if fd is not None and hasattr(os, 'writev'):
+        output.flush()
+        _writev(fd, parts)
+    else:
+        output.writelines(parts)
+
+
+def map_file(stream, offset: int, length: int) -> memoryview:
+    #read-only view of a file region; the mapping lives as long as the view
+    if length == 0:
+        return memoryview(b'')
+    aligned = offset - offset % mmap.ALLOCATIONGRANULARITY
+    mapped = mmap.mmap(_fileno(stream), length + offset - aligned, access=mmap.ACCESS_READ, offset=aligned)
+    return memoryview(mapped)[offset - aligned:]
+
+
 class Envelope:
-    _MAX_SIZE = 128*1024*1024 # 128 Mb
+    #size of the pieces in which data is copied between an asyncio stream and the envelope
+    STREAM_CHUNK_SIZE = 1024*1024 # 1 Mb
 
-    def __init__(self, meta: Meta, data : Optional[Binary] = None):
+    def __init__(self, meta: Meta, data : Optional[Binary] = None, codec: Union[str, Codec, None] = None,
+                 shuffle: int = 0, chunk_size: int = DEFAULT_CHUNK_SIZE):
         self.meta = meta
         self.data = data
+        #compression of the data section on write; shuffle is the item size of typed data
+        self.codec = None if codec is None else get_codec(codec)
+        self.shuffle = shuffle
+        self.chunk_size = chunk_size
+        if not 0 <= shuffle < 256 or shuffle == ord(NONE):
+            raise ValueError(f"Illegal shuffle item size {shuffle}")
+        if chunk_size <= 0:
+            raise ValueError(f"Illegal compression chunk size {chunk_size}")
 
     def __str__(self):
         return str(self.meta)
 
+    @property
+    def data(self) -> Optional[Binary]:
+        if self._data is None and self.compressed is not None:
+            self._data = self.compressed.decompress()
+        return self._data
+
+    @data.setter
+    def data(self, data: Optional[Binary]):
+        self._data = data
+        #compressed section the envelope was read from, decompressed on first access to data
+        self.compressed: Optional[CompressedData] = None
+
     @staticmethod
-    def read(input: BufferedReader | BytesIO) -> "Envelope":
-    
-        if isinstance(input, (bytes, bytearray)):
-            stream = io.BytesIO(input)
-        elif isinstance(input, io.BufferedReader):
-            stream = input
-        else:
-            raise ValueError("data should be either bytearray or file 'rb' mode.")
-            
-        assert b'#~'   == stream.read(2), "Illegal beginning (not #~)"
-        assert b'DF02' == stream.read(4), 'Illegal envelope format type'
-        stream.read(2)
+    def parse_header(header: Binary) -> tuple[int, int, bytes]:
+        start, type, reserved, meta_length, data_length = HEADER.unpack(header)
+        assert start == START, "Illegal beginning (not #~)"
+        assert type == TYPE, 'Illegal envelope format type'
+        return meta_length, data_length, reserved
 
-        metaLength = int.from_bytes(stream.read(4))
-        data = int.from_bytes(stream.read(4))
+    @staticmethod
+    def _create(meta: Meta, reserved: bytes, section: Binary) -> "Envelope":
+        codec, shuffle = reserved[:1], reserved[1]
+        shuffle = 0 if shuffle == ord(NONE) else shuffle
+        if codec == NONE:
+            return Envelope(meta, section)
+        envelope = Envelope(meta, None, codec, shuffle)
+        envelope.compressed = CompressedData(memoryview(section), envelope.codec, shuffle)
+        envelope.chunk_size = envelope.compressed.chunk_size
+        return envelope
+
+    @staticmethod
+    def unpack(buffer: Binary, offset: int = 0) -> tuple["Envelope", int]:
+        #zero-copy: data of the envelope is a view of buffer; returns the envelope and its end offset
+        view = memoryview(buffer).cast('B')
+        meta_length, data_length, reserved = Envelope.parse_header(view[offset:offset + HEADER.size])
+        meta_start = offset + HEADER.size
+        data_start = meta_start + meta_length
+        end = data_start + data_length
+        assert view[end:end + len(END)] == END, "Envelope byte sequence doesn't end with b'~#'"
+        meta = json.loads(bytes(view[meta_start:data_start]))
+        return Envelope._create(meta, reserved, view[data_start:end]), end + len(END)
+
+    @staticmethod
+    def read(input: Union[Binary, BufferedReader, BytesIO, RawIOBase]) -> "Envelope":
+        """
+        Reads an envelope from a buffer or a binary stream. Data of buffers and files is not
+        copied: it is a memoryview of the buffer or of the mapped file. Data read from BytesIO
+        is copied, a view of its buffer would make the BytesIO unwritable while the envelope lives.
+        """
+        if isinstance(input, (bytes, bytearray, memoryview, array.array, mmap.mmap)):
+            return Envelope.unpack(input)[0]
+        if isinstance(input, BytesIO):
+            with input.getbuffer() as buffer:
+                envelope, end = Envelope.unpack(buffer, input.tell())
+                if envelope.compressed is not None:
+                    envelope.compressed.section = memoryview(bytes(envelope.compressed.section))
+                else:
+                    envelope.data = bytes(envelope.data)
+            input.seek(end)
+            return envelope
+        if not hasattr(input, 'readinto'):
+            raise ValueError("data should be either bytes-like or binary stream.")
+        stream = input
 
-        dataLength = json.loads(stream.read(metaLength))
+        header = bytearray(HEADER.size)
+        assert _readinto(stream, memoryview(header)) == HEADER.size, "Unexpected end of envelope header"
+        meta_length, data_length, reserved = Envelope.parse_header(header)
+        meta = json.loads(stream.read(meta_length))
 
-        if dataLength < Envelope._MAX_SIZE:
-            data = stream.read(dataLength)
+        if _fileno(stream) is not None and stream.seekable():
+            data_start = stream.tell()
+            data = map_file(stream, data_start, data_length)
+            stream.seek(data_start + data_length)
         else:
-            data = mmap.mmap(stream.fileno(), dataLength, offset = stream.tell())
+            data = bytearray(data_length)
+            assert _readinto(stream, memoryview(data)) == data_length, "Unexpected end of envelope data"
 
-        assert b'~#' == stream.read(2), "Envelope byte sequence doesn't end with b'~#'"
+        assert END == stream.read(len(END)), "Envelope byte sequence doesn't end with b'~#'"
 
-        return Envelope(meta, data)
+        return Envelope._create(meta, reserved, data)
 
 
     @staticmethod
-    def from_bytes(buffer: bytes) -> "Envelope":
-        return Envelope.read(BytesIO(buffer))
+    def from_bytes(buffer: Binary) -> "Envelope":
+        return Envelope.read(buffer)
+
+
+    def section(self) -> list[memoryview]:
+        #data section as stored: raw data or frame and chunks of the compressed data
+        if self.codec is None:
+            return [memoryview(b'' if self.data is None else self.data).cast('B')]
+        compressed = self.compressed
+        if self._data is None and compressed is not None and \
+                (compressed.codec, compressed.itemsize) == (self.codec, self.shuffle):
+            #not decompressed, not modified: written as it was read
+            return [compressed.section]
+        return compress(memoryview(self.data).cast('B'), self.codec, self.shuffle, self.chunk_size)
+
+    def parts(self) -> list[memoryview]:
+        #envelope as a list of buffers: header, meta, data section parts, terminator
+        meta = json.dumps(self.meta, cls=MetaEncoder).encode('utf8')
+        section = self.section()
+        reserved = (NONE if self.codec is None else self.codec.id) + \
+            (NONE if self.codec is None or self.shuffle == 0 else bytes([self.shuffle]))
+        header = HEADER.pack(START, TYPE, reserved, len(meta), sum(len(p) for p in section))
+        return [memoryview(header), memoryview(meta), *section, memoryview(END)]
 
 
     def to_bytes(self) -> bytes:
-        output = BytesIO()
-        self.write_to(output)
-        output.seek(0)
-        return output.read()
+        return b''.join(self.parts())
 
 
-    def write_to(self, output: RawIOBase | BytesIO):
-        output.write(b'#~')
-        output.write(b'DF02')
-        output.write(b'..')
-        meta_str = bytes(json.dumps(self.meta), 'utf8')
+    def write_to(self, output: Union[RawIOBase, BytesIO]):
+        write_parts(output, self.parts())
 
-        output.write(len(meta_str ).to_bytes(4))
-        output.write(len(self.data).to_bytes(4))
-        output.write(meta_str)
-        output.write(self.data)
 
-        output.write(b'~#')
\ No newline at end of file
+    @staticmethod
+    async def read_async(reader: "StreamReader") -> "Envelope":
+        return await Envelope._read_body_async(reader, await reader.readexactly(HEADER.size))
+
+    @staticmethod
+    async def _read_body_async(reader: "StreamReader", header: bytes) -> "Envelope":
+        meta_length, data_length, reserved = Envelope.parse_header(header)
+        meta = json.loads(await reader.readexactly(meta_length))
+
+        #data is copied chunk by chunk into a single buffer, the reader never holds all of it
+        data = bytearray(data_length)
+        view = memoryview(data)
+        done = 0
+        while done < data_length:
+            chunk = await reader.read(min(Envelope.STREAM_CHUNK_SIZE, data_length - done))
+            if not chunk:
+                from asyncio import IncompleteReadError
+                raise IncompleteReadError(bytes(view[:done]), data_length)
+            view[done:done + len(chunk)] = chunk
+            done += len(chunk)
+
+        assert END == await reader.readexactly(len(END)), "Envelope byte sequence doesn't end with b'~#'"
+        return Envelope._create(meta, reserved, data)
+
+    @staticmethod
+    async def iter_async(reader: "StreamReader") -> AsyncIterator["Envelope"]:
+        #consecutive envelopes of a stream until it is closed
+        from asyncio import IncompleteReadError
+        while True:
+            try:
+                header = await reader.readexactly(HEADER.size)
+            except IncompleteReadError as e:
+                if e.partial:
+                    raise
+                return
+            yield await Envelope._read_body_async(reader, header)
+
+    async def write_async(self, writer: "StreamWriter"):
+        header, meta, *section, end = self.parts()
+        writer.writelines((header, meta))
+        #drain after each chunk keeps the transport buffer bounded
+        for data in section:
+            for start in range(0, len(data), Envelope.STREAM_CHUNK_SIZE):
+                writer.write(data[start:start + Envelope.STREAM_CHUNK_SIZE])
+                await writer.drain()
+        writer.write(end)
+        await writer.drain()
@@ -0,0 +1,184 @@
+"""
+Envelope archive: DF02 envelopes written one after another and followed by a footer index,
+so that any envelope (or only its meta) can be read without parsing the ones before it.
+
+Footer (little-endian, starts at an 8 byte boundary):
+    offsets, meta lengths, data lengths    3 arrays of count uint64
+    indexed meta fields                    JSON {"keys": [...], "values": [[...], ...]}
+    trailer                                INDEX_TRAILER: magic, count, footer offset, JSON length
+"""
+import array
+import json
+import mmap
+import struct
+import sys
+from typing import Union, Iterable, Iterator, Callable, Sized, Any
+
+from .envelope import Envelope, HEADER, END
+from .meta import Meta, get_meta_attr
+
+INDEX_TRAILER = struct.Struct('<8sQQQ')
+INDEX_MAGIC = b'DF02IDX\x00'
+
+
+def _uint64s(view: memoryview) -> Union[memoryview, array.array]:
+    if sys.byteorder == 'little':
+        return view.cast('Q')
+    values = array.array('Q')
+    values.frombytes(view)
+    values.byteswap()
+    return values
+
+
+class EnvelopeArchiveWriter:
+
+    def __init__(self, path, keys: Iterable[str] = ()):
+        self.file = open(path, 'wb')
+        #meta fields stored in the footer for filtering without parsing meta
+        self.keys = tuple(keys)
+        self._offsets = array.array('Q')
+        self._meta_lengths = array.array('Q')
+        self._data_lengths = array.array('Q')
+        self._values = []
+        self._offset = 0
+
+    def __enter__(self) -> "EnvelopeArchiveWriter":
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def __len__(self) -> int:
+        return len(self._offsets)
+
+    def append(self, envelope: Envelope) -> int:
+        parts = envelope.parts()
+        self._offsets.append(self._offset)
+        self._meta_lengths.append(len(parts[1]))
+        self._data_lengths.append(sum(len(part) for part in parts[2:-1]))
+        self._values.append([get_meta_attr(envelope.meta, key) for key in self.keys])
+        #buffered file passes large data sections to the OS without copying them
+        self.file.writelines(parts)
+        self._offset += sum(len(part) for part in parts)
+        return len(self._offsets) - 1
+
+    def extend(self, envelopes: Iterable[Envelope]):
+        for envelope in envelopes:
+            self.append(envelope)
+
+    def close(self):
+        if self.file.closed:
+            return
+        self.file.write(b'\0' * (-self.file.tell() % 8))
+        footer = self.file.tell()
+        for values in (self._offsets, self._meta_lengths, self._data_lengths):
+            if sys.byteorder != 'little':
+                values = array.array('Q', values)
+                values.byteswap()
+            self.file.write(values.tobytes())
+        keys = json.dumps({'keys': self.keys, 'values': self._values}).encode('utf8')
+        self.file.write(keys)
+        self.file.write(INDEX_TRAILER.pack(INDEX_MAGIC, len(self._offsets), footer, len(keys)))
+        self.file.close()
+
+
+class EnvelopeArchive(Sized):
+    """
+    Read-only access to an envelope archive through mmap. Envelopes returned by the archive
+    keep views of the mapping. Files of plain concatenated envelopes (without a footer) are
+    indexed by walking the envelope headers once.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.file = open(path, 'rb')
+        self._mmap = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ) \
+            if self.file.seek(0, 2) > 0 else None
+        self._view = memoryview(self._mmap if self._mmap is not None else b'')
+        self.keys: tuple[str, ...] = ()
+        self._values: list[list] = []
+        if not self._read_footer():
+            self._scan()
+
+    def __enter__(self) -> "EnvelopeArchive":
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def _read_footer(self) -> bool:
+        view = self._view
+        if len(view) < INDEX_TRAILER.size:
+            return False
+        magic, count, footer, keys_length = INDEX_TRAILER.unpack(view[-INDEX_TRAILER.size:])
+        if magic != INDEX_MAGIC:
+            return False
+        size = 8 * count
+        self._offsets = _uint64s(view[footer:footer + size])
+        self._meta_lengths = _uint64s(view[footer + size:footer + 2 * size])
+        self._data_lengths = _uint64s(view[footer + 2 * size:footer + 3 * size])
+        keys = json.loads(bytes(view[footer + 3 * size:footer + 3 * size + keys_length]))
+        self.keys = tuple(keys['keys'])
+        self._values = keys['values']
+        return True
+
+    def _scan(self):
+        offsets, meta_lengths, data_lengths = array.array('Q'), array.array('Q'), array.array('Q')
+        view, offset = self._view, 0
+        while offset < len(view):
+            meta_length, data_length, _ = Envelope.parse_header(view[offset:offset + HEADER.size])
+            offsets.append(offset)
+            meta_lengths.append(meta_length)
+            data_lengths.append(data_length)
+            offset += HEADER.size + meta_length + data_length + len(END)
+        self._offsets, self._meta_lengths, self._data_lengths = offsets, meta_lengths, data_lengths
+
+    def close(self):
+        for view in (self._offsets, self._meta_lengths, self._data_lengths, self._view):
+            if isinstance(view, memoryview):
+                view.release()
+        if self._mmap is not None:
+            try:
+                self._mmap.close()
+            except BufferError:
+                #envelopes still refer to the mapping, it is closed when they are gone
+                pass
+        self.file.close()
+
+    def __len__(self) -> int:
+        return len(self._offsets)
+
+    def _index(self, item: int) -> int:
+        if item < 0:
+            item += len(self)
+        if not 0 <= item < len(self):
+            raise IndexError("envelope archive index out of range")
+        return item
+
+    def meta(self, item: int) -> Meta:
+        #parses only the meta section of an envelope
+        item = self._index(item)
+        start = self._offsets[item] + HEADER.size
+        return json.loads(bytes(self._view[start:start + self._meta_lengths[item]]))
+
+    def indexed(self, item: int) -> dict[str, Any]:
+        #meta fields stored in the footer
+        return dict(zip(self.keys, self._values[self._index(item)])) if self.keys else {}
+
+    def __getitem__(self, item: Union[int, slice]) -> Union[Envelope, list[Envelope]]:
+        if isinstance(item, slice):
+            return [self[i] for i in range(*item.indices(len(self)))]
+        return Envelope.unpack(self._view, self._offsets[self._index(item)])[0]
+
+    def __iter__(self) -> Iterator[Envelope]:
+        for i in range(len(self)):
+            yield self[i]
+
+    def select(self, predicate: Callable[[dict], bool], indexed: bool = False) -> list[int]:
+        #indices of envelopes whose meta (or indexed meta fields) satisfy predicate
+        fields = self.indexed if indexed else self.meta
+        return [i for i in range(len(self)) if predicate(fields(i))]
+
+    def filter(self, predicate: Callable[[dict], bool], indexed: bool = False) -> Iterator[Envelope]:
+        for i in self.select(predicate, indexed):
+            yield self[i]
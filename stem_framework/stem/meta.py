@@ -2,8 +2,8 @@
 Metadata (user-defined tree of values) provides information about other data.
 DataForge introduces the principle of metadata processor, id est during data processing only data and metadata are allowed to be used as input. No scripts or manual intermediate steps are allowed.
 """
-from dataclasses import dataclass, is_dataclass
-from typing import Optional, Any, Union, Type, Tuple
+from dataclasses import dataclass, is_dataclass, fields
+from typing import Optional, Any, Union, Type, Tuple, Hashable, Callable, Iterable, get_args, get_origin, get_type_hints
 from core import Dataclass
 
 Meta = Union[dict, Dataclass]
@@ -27,94 +27,242 @@ class MetaFieldError:
 
 class MetaVerification:
 
-    def __init__(self, *errors: Union[MetaFieldError, "MetaVerification"]):
+    def __init__(self, *errors: Union[MetaFieldError, "MetaVerification"], key: Optional[object] = None):
         self.error = errors
+        #key of the nested meta verified by this instance
+        self.key = key
 
     @property
     def checked_success(self):
-        if self.error == []:
-            return True
-        else:
-            return False
+        return len(self.error) == 0
+
+    @staticmethod
+    def compile(specification: Specification) -> Callable[[Meta], list]:
+        #validators are built once per specification and reused by every verify
+        try:
+            return _validators[specification]
+        except KeyError:
+            validator = _validators[specification] = _compile(specification)
+            return validator
+        except TypeError:
+            #unhashable specification can not be cached
+            return _compile(specification)
 
     @staticmethod
     def verify(meta: Meta,
                specification: Optional[Specification] = None) -> "MetaVerification":
+        if specification is None:
+            return MetaVerification()
+        return MetaVerification(*MetaVerification.compile(specification)(meta))
+
+    @staticmethod
+    def verify_many(metas: Union[Iterable[Meta], dict, Any],
+                    specification: Optional[Specification] = None) -> "MetaBatchVerification":
+        """
+        Verifies a batch of meta against one specification. metas is an iterable of meta,
+        or columns: a dict of equal length lists (field -> values) or a numpy structured array.
+        """
+        columns = isinstance(metas, dict) or getattr(getattr(metas, 'dtype', None), 'names', None) is not None
+        if isinstance(metas, dict):
+            lengths = {len(column) for column in metas.values()}
+            if len(lengths) > 1:
+                raise ValueError("columns of meta have different lengths")
+            length = lengths.pop() if lengths else 0
+        elif columns:
+            length = len(metas)
+        if specification is None:
+            if not columns:
+                length = len(metas) if hasattr(metas, '__len__') else sum(1 for _ in metas)
+            return MetaBatchVerification({}, length)
+        validate = MetaVerification.compile(specification)
+        if columns:
+            return MetaBatchVerification(_column_errors(validate, metas, length), length)
+        return MetaBatchVerification(*_row_errors(validate, metas))
+
+
+class MetaBatchVerification:
+    """
+    Result of MetaVerification.verify_many: errors[key] is a list of (index, error) of the
+    meta failing the field, in index order.
+    """
+
+    def __init__(self, errors: dict[object, list[tuple[int, Union[MetaFieldError, MetaVerification]]]], count: int):
+        self.errors = errors
+        self.count = count
+
+    @property
+    def checked_success(self):
+        return len(self.errors) == 0
+
+    @property
+    def failed(self) -> list[int]:
+        return sorted({index for group in self.errors.values() for index, _ in group})
+
+    def verification(self, index: int) -> MetaVerification:
+        #errors of a single meta, as returned by verify
+        return MetaVerification(*(error for group in self.errors.values() for i, error in group if i == index))
+
+
+_MISSING = object()
+
+_validators: dict = {}
+
+
+def _required_types(required) -> Optional[Tuple[Type, ...]]:
+    #flatten annotation into a tuple usable by isinstance; None means any value
+    if required is Any or isinstance(required, str):
+        return None
+    if isinstance(required, type):
+        return (required,)
+    if isinstance(required, tuple):
+        types = []
+        for r in required:
+            flat = _required_types(r)
+            if flat is None:
+                return None
+            types.extend(flat)
+        return tuple(types)
+    origin = get_origin(required)
+    if origin is Union:
+        return _required_types(get_args(required))
+    if isinstance(origin, type):
+        #list[int] is checked as list
+        return (origin,)
+    return None
+
+
+def _is_specification(required) -> bool:
+    if isinstance(required, type):
+        return is_dataclass(required)
+    return isinstance(required, tuple) and len(required) > 0 and \
+        all(isinstance(f, tuple) and len(f) == 2 for f in required)
+
 
-        if is_dataclass(specification):
-            #if type dataclass
-            spec_keys = specification.__dataclass_fields__.keys()
+def _specification_fields(specification: Specification) -> list:
+    if isinstance(specification, type) and is_dataclass(specification):
+        try:
+            hints = get_type_hints(specification)
+        except Exception:
+            hints = {}
+        return [(f.name, hints.get(f.name, f.type)) for f in fields(specification)]
+    if isinstance(specification, tuple):
+        return list(specification)
+    raise SpecificationError(f"{specification!r} is neither a dataclass nor a tuple of (key, types)")
+
+
+def _compile(specification: Specification) -> Callable[[Meta], list]:
+    plan = []
+    for key, required in _specification_fields(specification):
+        if _is_specification(required):
+            nested = MetaVerification.compile(required)
+            types = (required,) if isinstance(required, type) else (dict,)
+            plan.append((key, types, nested))
         else:
-            #tuple (in order to work let's convert tuple to dict
-            spec_dict = dict(specification)
-            spec_keys = spec_dict.keys()
+            plan.append((key, _required_types(required), None))
+    plan = tuple(plan)
 
-        if is_dataclass(meta):
-            meta_keys = meta.__dataclass_fields__.keys()
+    def validate(meta: Meta) -> list:
+        errors = []
+        if isinstance(meta, dict):
+            get = meta.get
         else:
-            meta_keys = meta.keys()
+            get = lambda key, default: getattr(meta, key, default)
+        for key, types, nested in plan:
+            value = get(key, _MISSING)
+            if value is _MISSING:
+                errors.append(MetaFieldError(key, types))
+            elif nested is not None:
+                error = _verify_nested(key, types, nested, value)
+                if error is not None:
+                    errors.append(error)
+            elif types is not None and not isinstance(value, types):
+                errors.append(MetaFieldError(key, types, type(value), value))
+        return errors
 
-        errs = []
+    validate.plan = plan
+    return validate
 
-        for key in spec_keys:
-            #to dataclass and tuple (now dict) vars we address differently
-            if is_dataclass(specification):
-                target_types = specification.__dataclass_fields__[key].type
-            else:
-                target_types = specification[key]
-
-            if key not in meta_keys:
-                errs.append(
-                    MetaFieldError(
-                        target_key = key,
-                        target_types = target_types
-                    )
-                )
+
+def _verify_nested(key, types, nested: Callable[[Meta], list], value: Any) -> Optional[Union[MetaFieldError, MetaVerification]]:
+    if isinstance(value, dict) or (is_dataclass(value) and not isinstance(value, type)):
+        nested_errors = nested(value)
+        return MetaVerification(*nested_errors, key=key) if nested_errors else None
+    return MetaFieldError(key, types, type(value), value)
+
+
+def _error_key(error: Union[MetaFieldError, MetaVerification]):
+    return error.required_key if isinstance(error, MetaFieldError) else error.key
+
+
+def _row_errors(validate: Callable[[Meta], list], metas: Iterable[Meta]) -> tuple[dict, int]:
+    errors = {}
+    count = 0
+    for index, meta in enumerate(metas):
+        count += 1
+        for error in validate(meta):
+            errors.setdefault(_error_key(error), []).append((index, error))
+    return errors, count
+
+
+def _column_type(column) -> Optional[type]:
+    #python type of the items of a numpy column, None if items have to be converted one by one
+    #(object columns; datetime64/timedelta64 items become datetime, date or int depending on the unit)
+    kind = column.dtype.kind
+    if kind in 'SU':
+        return bytes if kind == 'S' else str
+    if kind in 'biufc':
+        return type(column.dtype.type(0).item())
+    return None
+
+
+def _column_errors(validate: Callable[[Meta], list], columns, length: int) -> dict:
+    #columns are a dict of lists or a numpy structured array, every field is checked at once
+    errors = {}
+    structured = not isinstance(columns, dict)
+    names = columns.dtype.names if structured else columns
+    for key, types, nested in validate.plan:
+        if key not in names:
+            errors[key] = [(i, MetaFieldError(key, types)) for i in range(length)]
+            continue
+        column = columns[key]
+
+        if nested is not None:
+            if structured and column.dtype.names is not None:
+                rows = {}
+                for group in _column_errors(nested, column, length).values():
+                    for index, error in group:
+                        rows.setdefault(index, []).append(error)
+                group = [(i, MetaVerification(*rows[i], key=key)) for i in sorted(rows)]
             else:
-                master_value = get_meta_attr(meta, key)
-                master_type = type(top_value)
-                #we need to verify on any nesting level
-                if (isinstance(target_types, type) or (
-                    isinstance(target_types, tuple) and isinstance(target_types[0], type)
-                )):
-                #no recursion, no nesting levels
-                    if not issubclass(master_type, target_types):
-                        errors.append(
-                            MetaFieldError(
-                                target_key = target_key,
-                                target_types = target_types,
-                                master_value = master_value,
-                                master_type = master_type
-                            )
-                        )
-                else:
-                    #entering recursion, subclasses detected
-                    sub_errs = MetaVerification.verify(
-                        get_meta_attr(meta, target_key),
-                        target_types
-                    ).error
-
-                    if sub_errs != ():
-                        errors.append(sub_errs)
-
-        return MetaVerification(*errors)
+                group = []
+                for index, value in enumerate(column):
+                    error = _verify_nested(key, types, nested, value)
+                    if error is not None:
+                        group.append((index, error))
+            if group:
+                errors[key] = group
+            continue
 
+        if types is None:
+            continue
+        if structured:
+            item_type = _column_type(column)
+            if item_type is not None and issubclass(item_type, types):
+                continue
+            column = column.tolist()
+        #only distinct item types are checked unless some of them fail
+        if all(issubclass(t, types) for t in set(map(type, column))):
+            continue
+        errors[key] = [(i, MetaFieldError(key, types, type(v), v))
+                       for i, v in enumerate(column) if not isinstance(v, types)]
+    return errors
 
 
 def get_meta_attr(meta : Meta, key : str, default : Optional[Any] = None) -> Optional[Any]:
     #meta can be either Dataclass or dict
-    #checking Dataclass, it should have dataclass fiels
-    try:
-        return getattr(meta, key)
-    except AttributeError:
-        return default
-    except TypeError:
-        pass
-
-    try:
-        return meta[key]
-    except KeyError:
-         return default
+    if isinstance(meta, dict):
+        return meta.get(key, default)
+    return getattr(meta, key, default)
 
 
 def update_meta(meta: Meta, **kwargs):
@@ -125,3 +273,22 @@ def update_meta(meta: Meta, **kwargs):
     else:
         for key, value in kwargs.items():
             meta[key] = value
+
+
+def freeze_meta(meta: Any) -> Hashable:
+    #hashable canonical form of a meta subtree: equal meta gives equal keys
+    if is_dataclass(meta) and not isinstance(meta, type):
+        return (type(meta).__name__,
+                tuple((f.name, freeze_meta(getattr(meta, f.name))) for f in fields(meta)))
+    if isinstance(meta, dict):
+        return tuple(sorted(((k, freeze_meta(v)) for k, v in meta.items()), key=lambda kv: repr(kv[0])))
+    if isinstance(meta, (list, tuple)):
+        return (type(meta).__name__, tuple(freeze_meta(v) for v in meta))
+    if isinstance(meta, (set, frozenset)):
+        return frozenset(freeze_meta(v) for v in meta)
+    try:
+        hash(meta)
+        return meta
+    except TypeError:
+        #unknown mutable value: only identical objects are considered equal
+        return ('id', id(meta))
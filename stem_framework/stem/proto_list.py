@@ -1,38 +1,403 @@
-from typing import Type, Iterable, Sized, Iterator, NewType
-from google.protobuf.reflection import GeneratedProtocolMessageType
+"""
+List of protobuf messages stored in a file as (8 byte big-endian length, serialized message) records.
+Offsets of the records are kept in a sidecar index file (<path>.idx), rebuilt when the data file changes.
+"""
+import array
+import mmap
+import os
+import struct
+import sys
+import time
+from collections import deque
+from operator import attrgetter
+from typing import Type, Iterable, Sized, Iterator, NewType, Union, Optional, Callable, TypeVar, Sequence, Any, TYPE_CHECKING
+
+#protobuf is only needed by the message classes passed in
+if TYPE_CHECKING:
+    from google.protobuf.reflection import GeneratedProtocolMessageType
+
+LENGTH = struct.Struct('>Q')
+#magic, data file size, data file mtime in ns, number of offsets
+INDEX_HEADER = struct.Struct('<8sQqQ')
+INDEX_MAGIC = b'PLIDX001'
+INDEX_SUFFIX = '.idx'
+BATCH_SIZE = 4096
+#numpy types of scalar protobuf fields by FieldDescriptor.cpp_type (int32, int64, uint32, uint64, double, float, bool, enum)
+COLUMN_TYPES = {1: 'i4', 2: 'i8', 3: 'u4', 4: 'u8', 5: 'f8', 6: 'f4', 7: '?', 8: 'i4'}
+
+T = TypeVar("T")
+
+
+def index_path(path) -> str:
+    return os.fspath(path) + INDEX_SUFFIX
+
+
+def scan_offsets(buffer, start: int = 0, offsets: Optional[array.array] = None) -> array.array:
+    #record offsets from start; the last offset is the end of the last complete record
+    offsets = array.array('Q', [start]) if offsets is None else offsets
+    size = len(buffer)
+    unpack_from = LENGTH.unpack_from
+    position = start
+    while position + LENGTH.size <= size:
+        end = position + LENGTH.size + unpack_from(buffer, position)[0]
+        if end > size:
+            #torn tail: the record is not written completely
+            break
+        offsets.append(end)
+        position = end
+    return offsets
+
+
+def load_index(path, stat: os.stat_result) -> Optional[array.array]:
+    try:
+        with open(index_path(path), 'rb') as f:
+            magic, size, mtime, count = INDEX_HEADER.unpack(f.read(INDEX_HEADER.size))
+            if magic != INDEX_MAGIC or size != stat.st_size or mtime != stat.st_mtime_ns:
+                return None
+            offsets = array.array('Q')
+            offsets.fromfile(f, count)
+    except (OSError, EOFError, struct.error):
+        return None
+    if sys.byteorder != 'little':
+        offsets.byteswap()
+    return offsets
+
+
+def save_index(path, stat: os.stat_result, offsets: array.array):
+    values = offsets
+    if sys.byteorder != 'little':
+        values = array.array('Q', offsets)
+        values.byteswap()
+    tmp = index_path(path) + '.tmp'
+    try:
+        with open(tmp, 'wb') as f:
+            f.write(INDEX_HEADER.pack(INDEX_MAGIC, stat.st_size, stat.st_mtime_ns, len(values)))
+            values.tofile(f)
+        os.replace(tmp, index_path(path))
+    except OSError:
+        #read-only location: the index is rebuilt on the next open
+        pass
 
 
 class ProtoList(Sized, Iterable):
 
-    def __init__(self, path, proto_class: GeneratedProtocolMessageType):
+    def __init__(self, path, proto_class: "GeneratedProtocolMessageType"):
         self.path = path
         self.proto_class = proto_class
 
     def __enter__(self) -> "ProtoList":
         self.file = open(self.path, 'rb')
+        stat = os.fstat(self.file.fileno())
+        self._map(stat.st_size)
+
+        self.offsets = load_index(self.path, stat)
+        if self.offsets is None:
+            self.offsets = scan_offsets(self._buffer)
+            save_index(self.path, stat, self.offsets)
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self._unmap()
+        self.file.__exit__(exc_type, exc_val, exc_tb)
+
+    def _map(self, size: int):
+        self._mmap = mmap.mmap(self.file.fileno(), size, access=mmap.ACCESS_READ) if size > 0 else None
+        self._buffer = memoryview(self._mmap if self._mmap is not None else b'')
+
+    def _unmap(self):
+        self._buffer.release()
+        if self._mmap is not None:
+            try:
+                self._mmap.close()
+            except BufferError:
+                #messages still refer to the old mapping, it is closed when they are gone
+                pass
+
+    def refresh(self) -> int:
+        #picks up records appended since the file was opened (or refreshed); returns their number
+        size = os.fstat(self.file.fileno()).st_size
+        if size <= len(self._buffer):
+            return 0
+        count = len(self)
+        self._unmap()
+        self._map(size)
+        scan_offsets(self._buffer, self.offsets[-1], self.offsets)
+        return len(self) - count
+
+    def follow(self, poll_interval: float = 0.1, start: Optional[int] = None) \
+            -> Iterator["GeneratedProtocolMessageType"]:
+        #yields messages from start (the current end by default) as they are written, until the caller stops
+        position = len(self) if start is None else start
+        while True:
+            self.refresh()
+            if position < len(self):
+                for batch in self.iter_batches(start=position):
+                    yield from batch
+                position = len(self)
+            else:
+                time.sleep(poll_interval)
+
+    def __len__(self) -> int:
+        return len(self.offsets) - 1
+
+    def message_bytes(self, item: int) -> memoryview:
+        #serialized message, a view of the mapped file
+        return self._buffer[self.offsets[item] + LENGTH.size:self.offsets[item + 1]]
+
+    def parse(self, item: int) -> "GeneratedProtocolMessageType":
+        message = self.proto_class()
+        message.ParseFromString(self.message_bytes(item))
+        return message
+
+    def __getitem__(self, item: Union[int, slice]):
+        if isinstance(item, slice):
+            return ProtoListView(self, range(len(self))[item])
+        if item < 0:
+            item += len(self)
+        if not 0 <= item < len(self):
+            raise IndexError("ProtoList index out of range")
+        return self.parse(item)
+
+    def __iter__(self) -> Iterator["GeneratedProtocolMessageType"]:
+        for batch in self.iter_batches():
+            yield from batch
+
+    def parse_range(self, start: int, stop: int) -> list["GeneratedProtocolMessageType"]:
+        #messages of a contiguous range decoded from one block of the mapped file
+        offsets = self.offsets
+        base = offsets[start]
+        block = self._buffer[base:offsets[stop]]
+        proto_class = self.proto_class
+        messages = []
+        for i in range(start, stop):
+            message = proto_class()
+            message.ParseFromString(block[offsets[i] - base + LENGTH.size:offsets[i + 1] - base])
+            messages.append(message)
+        return messages
 
-        self.msg_len = []
-        self.msg_pos = []
+    def iter_batches(self, n: int = BATCH_SIZE, start: int = 0, stop: Optional[int] = None) \
+            -> Iterator[list["GeneratedProtocolMessageType"]]:
+        stop = len(self) if stop is None else min(stop, len(self))
+        for batch_start in range(start, stop, n):
+            yield self.parse_range(batch_start, min(batch_start + n, stop))
 
-        while (N := self.file.read(8)) != b'':
-            self.msg_pos.append(self.file.tell())
-            N = int.from_bytes(N)
-            self.msg_len.append(N)
-            self.file.seek(N, 1)
+    def map_batches(self, func: Callable[[list], T], n: int = BATCH_SIZE, workers: Optional[int] = None,
+                    ordered: bool = True) -> Iterator[T]:
+        """
+        Yields func(batch) for batches of n messages. With workers > 1 batches are decoded and
+        passed to func in a process pool: every worker maps the file and loads the index
+        itself, only the ranges and the results of func are sent between processes.
+        func should be picklable (a module level function).
+        """
+        if workers is None or workers <= 1:
+            for batch in self.iter_batches(n):
+                yield func(batch)
+            return
 
+        from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+        executor = ProcessPoolExecutor(max_workers=workers)
+        pending = deque()
+        ranges = iter(range(0, len(self), n))
+        try:
+            while True:
+                while len(pending) < 2 * workers:
+                    start = next(ranges, None)
+                    if start is None:
+                        break
+                    pending.append(executor.submit(
+                        _map_range, self.path, self.proto_class, func, start, min(start + n, len(self))))
+                if not pending:
+                    break
+
+                if ordered:
+                    future = pending.popleft()
+                else:
+                    done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                    future = done.pop()
+                    pending.remove(future)
+                yield future.result()
+        finally:
+            executor.shutdown(cancel_futures=True)
+
+    def column_types(self, fields: Sequence[str]) -> list[tuple[str, str]]:
+        #(field, numpy type) of scalar fields; nested fields are given as 'message.field'
+        types = []
+        for name in fields:
+            descriptor = self.proto_class.DESCRIPTOR
+            field = None
+            for part in name.split('.'):
+                if descriptor is None or part not in descriptor.fields_by_name:
+                    raise ValueError(f"{self.proto_class.__name__} has no field '{name}'")
+                field = descriptor.fields_by_name[part]
+                descriptor = field.message_type
+            #is_repeated replaced label in recent protobuf versions
+            repeated = field.is_repeated if hasattr(field, 'is_repeated') else field.label == field.LABEL_REPEATED
+            if repeated or field.cpp_type not in COLUMN_TYPES:
+                raise ValueError(f"field '{name}' is not a scalar numeric field")
+            types.append((name, COLUMN_TYPES[field.cpp_type]))
+        return types
+
+    def to_columns(self, fields: Sequence[str], start: int = 0, stop: Optional[int] = None,
+                   chunk_size: Optional[int] = None, structured: bool = False) -> Union[Any, Iterator[Any]]:
+        """
+        Projects scalar fields of messages [start, stop) into numpy arrays: a dict of arrays,
+        or one structured array with structured=True. Messages are decoded batch by batch and
+        dropped, only the preallocated arrays are kept. With chunk_size an iterator of such
+        columns for consecutive chunks of chunk_size messages is returned.
+        """
+        stop = len(self) if stop is None else min(stop, len(self))
+        if chunk_size is None:
+            return self._columns(self.column_types(fields), start, stop, structured)
+        types = self.column_types(fields)
+        return (self._columns(types, chunk_start, min(chunk_start + chunk_size, stop), structured)
+                for chunk_start in range(start, stop, chunk_size))
+
+    def _columns(self, types: list[tuple[str, str]], start: int, stop: int, structured: bool):
+        import numpy as np
+        count = max(stop - start, 0)
+        if structured:
+            table = np.empty(count, dtype=types)
+            columns = {name: table[name] for name, _ in types}
+        else:
+            columns = {name: np.empty(count, dtype=dtype) for name, dtype in types}
+        getters = [(columns[name], np.dtype(dtype), attrgetter(name)) for name, dtype in types]
+
+        for batch_start in range(start, stop, BATCH_SIZE):
+            batch = self.parse_range(batch_start, min(batch_start + BATCH_SIZE, stop))
+            position = batch_start - start
+            for column, dtype, getter in getters:
+                column[position:position + len(batch)] = np.fromiter(map(getter, batch), dtype, len(batch))
+        return table if structured else columns
+
+
+#lists opened by pool workers, one per file and message class
+_worker_lists: dict[tuple, ProtoList] = {}
+
+
+def _map_range(path, proto_class, func: Callable[[list], T], start: int, stop: int) -> T:
+    proto_list = _worker_lists.get((path, proto_class))
+    if proto_list is None:
+        proto_list = _worker_lists[(path, proto_class)] = ProtoList(path, proto_class).__enter__()
+    return func(proto_list.parse_range(start, stop))
+
+
+class ProtoListView(Sized, Iterable):
+    #lazy slice of a ProtoList: messages are parsed on access
+
+    def __init__(self, proto_list: ProtoList, indices: range):
+        self.proto_list = proto_list
+        self.indices = indices
+
+    def __len__(self) -> int:
+        return len(self.indices)
+
+    def __getitem__(self, item: Union[int, slice]):
+        if isinstance(item, slice):
+            return ProtoListView(self.proto_list, self.indices[item])
+        return self.proto_list.parse(self.indices[item])
+
+    def __iter__(self) -> Iterator["GeneratedProtocolMessageType"]:
+        for n in self.indices:
+            yield self.proto_list.parse(n)
+
+
+class ProtoListWriter(Sized):
+    """
+    Appends messages in the ProtoList format. Serialized records are collected in memory and
+    written with one write call once buffer_size bytes are pending (group commit); with
+    sync_every the file is fsync'ed after at least that many messages since the last fsync.
+    The sidecar index is extended after every write. On open a torn last record left by a
+    crash is cut off; the number of dropped bytes is kept in recovered.
+    """
+    BUFFER_SIZE = 1024*1024 # 1 Mb
+
+    def __init__(self, path, buffer_size: int = BUFFER_SIZE, sync_every: Optional[int] = None):
+        self.path = path
+        self.buffer_size = buffer_size
+        self.sync_every = sync_every
+
+    def __enter__(self) -> "ProtoListWriter":
+        self.file = open(self.path, 'a+b', buffering=0)
+        stat = os.fstat(self.file.fileno())
+        self.offsets = load_index(self.path, stat)
+        if self.offsets is None:
+            with mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ) if stat.st_size > 0 \
+                    else memoryview(b'') as buffer:
+                self.offsets = scan_offsets(buffer)
+        self.recovered = stat.st_size - self.offsets[-1]
+        if self.recovered:
+            self.file.truncate(self.offsets[-1])
+            stat = os.fstat(self.file.fileno())
+
+        save_index(self.path, stat, self.offsets)
+        self._index = open(index_path(self.path), 'r+b')
+        self._indexed = len(self.offsets)
+        self._pending: list[bytes] = []
+        self._pending_size = 0
+        self._unsynced = 0
         return self
 
     def __exit__(self, exc_type, exc_val, exc_tb):
-        self.file.__exit__(exc_type, exc_val, exc_tb)
+        self.close()
 
     def __len__(self) -> int:
-        return self.msg_len.__len__()
+        return len(self.offsets) - 1 + len(self._pending) // 2
+
+    def append(self, message: "GeneratedProtocolMessageType"):
+        data = message.SerializeToString()
+        self._pending.append(LENGTH.pack(len(data)))
+        self._pending.append(data)
+        self._pending_size += LENGTH.size + len(data)
+        if self._pending_size >= self.buffer_size:
+            self.flush()
+
+    def extend(self, messages: Iterable["GeneratedProtocolMessageType"]):
+        for message in messages:
+            self.append(message)
+
+    def flush(self, sync: bool = False):
+        if self._pending:
+            self._write_all(b''.join(self._pending))
+            end = self.offsets[-1]
+            for data in self._pending[1::2]:
+                end += LENGTH.size + len(data)
+                self.offsets.append(end)
+            self._unsynced += len(self._pending) // 2
+            self._pending = []
+            self._pending_size = 0
+        if sync or (self.sync_every is not None and self._unsynced >= self.sync_every):
+            os.fsync(self.file.fileno())
+            self._unsynced = 0
+        self._write_index()
+
+    def _write_all(self, data: bytes):
+        #unbuffered write may write only a part of the data; a failed write leaves no torn records
+        view = memoryview(data)
+        try:
+            while view:
+                view = view[self.file.write(view):]
+        except BaseException:
+            self.file.truncate(self.offsets[-1])
+            raise
 
-    def __getitem__(self, item):
-        self.file.seek(self.msg_pos[item])
-        N = self.msg_len[item]
-        return self.proto_class().ParseFromString(self.file.read(N))
+    def _write_index(self):
+        #new offsets go to the end of the index, then the header is updated to match the data file
+        if self._indexed == len(self.offsets):
+            return
+        values = self.offsets[self._indexed:]
+        if sys.byteorder != 'little':
+            values.byteswap()
+        self._index.seek(0, 2)
+        self._index.write(values.tobytes())
+        stat = os.fstat(self.file.fileno())
+        self._index.seek(0)
+        self._index.write(INDEX_HEADER.pack(INDEX_MAGIC, stat.st_size, stat.st_mtime_ns, len(self.offsets)))
+        self._index.flush()
+        self._indexed = len(self.offsets)
 
-    def __iter__(self) -> Iterator[GeneratedProtocolMessageType]:
-        for n in range(self.__len__()):
-            yield self[n]
+    def close(self):
+        if self.file.closed:
+            return
+        self.flush(sync = self.sync_every is not None)
+        self._index.close()
+        self.file.close()
@@ -4,8 +4,13 @@ Pull data flow model is implemented in DataForge by workplaces and tasks. The ta
         2) Lazy computation model (a ’Goal’ object is created for each specific computation).
         3) Computation (when the top level goal is triggered, it invokes computation of all goals in chain behind it).
 """
-from typing import TypeVar, Union, Tuple, Callable, Optional, Generic, Any, Iterator
+from typing import TypeVar, Union, Tuple, Callable, Optional, Generic, Any, Iterator, Iterable
+import sys
 from abc import ABC, abstractmethod
+from collections import deque
+from functools import reduce
+from importlib import import_module
+from itertools import islice
 from core import Named
 from meta import Specification, Meta
 
@@ -20,11 +25,41 @@ class Task(ABC, Generic[T], Named):
     def check_by_meta(self, meta: Meta):
         pass
 
+    @property
+    def is_coroutine(self) -> bool:
+        #transform returns a coroutine which has to be awaited
+        return iscoroutinefunction(self.transform)
+
     @abstractmethod
     def transform(self, meta: Meta, /, **kwargs: Any) -> T:
         pass
 
 
+def iscoroutinefunction(func: Callable) -> bool:
+    #inspect is imported on demand, it is slow to import for CLI startup
+    from inspect import iscoroutinefunction
+    return iscoroutinefunction(func)
+
+
+def _find_decorated(module: str, qualname: str) -> "Task":
+    obj = import_module(module)
+    for name in qualname.split('.'):
+        obj = getattr(obj, name)
+    return obj
+
+
+def _reduce_by_reference(task: Task, default: tuple) -> tuple:
+    #decorated functions are replaced by their task in the module, so the function
+    #can not be pickled by reference; the task is pickled as the module attribute instead
+    module, qualname = task._func.__module__, task._func.__qualname__
+    try:
+        if _find_decorated(module, qualname) is task:
+            return _find_decorated, (module, qualname)
+    except (ImportError, AttributeError):
+        pass
+    return default
+
+
 class FunctionTask(Task[T]):
     def __init__(self, name: str, func: Callable, dependencies: Tuple[Union[str, "Task"], ...],
                  specification: Optional[Specification] = None,
@@ -38,6 +73,14 @@ class FunctionTask(Task[T]):
     def __call__(self, *args, **kwargs):
         return self._func(*args, **kwargs)
 
+    @property
+    def is_coroutine(self) -> bool:
+        return iscoroutinefunction(self._func)
+
+    def __reduce__(self):
+        return _reduce_by_reference(self, (FunctionTask, (self._name, self._func, self.dependencies,
+                                                         self.specification, self.settings)))
+
     def transform(self, meta: Meta, /, **kwargs: Any) -> T:
         return self._func(meta, **kwargs)
 
@@ -49,6 +92,10 @@ class DataTask(Task[T]):
     def data(self, meta: Meta) -> T:
         pass
 
+    @property
+    def is_coroutine(self) -> bool:
+        return iscoroutinefunction(self.data)
+
     def transform(self, meta: Meta, /, **kwargs: Any) -> T:
         return self.data(meta)
 
@@ -65,10 +112,29 @@ class FunctionDataTask(DataTask[T]):
     def __call__(self, *args, **kwargs):
         return self._func(*args, **kwargs)
 
+    @property
+    def is_coroutine(self) -> bool:
+        return iscoroutinefunction(self._func)
+
+    def __reduce__(self):
+        return _reduce_by_reference(self, (FunctionDataTask, (self._name, self._func,
+                                                             self.specification, self.settings)))
+
     def data(self, meta: Meta) -> T:
         return self._func(meta)
 
 
+#tasks and workspaces declared at module level: module name -> {name: object},
+#filled by @data/@task and the Workspace metaclass for lazy module_workspace discovery
+declared: dict[str, dict[str, Any]] = {}
+
+
+def declare(obj: Any, module: str, qualname: str) -> Any:
+    if '.' not in qualname and '<' not in qualname:
+        declared.setdefault(module, {})[qualname] = obj
+    return obj
+
+
 def data(func: Callable[[Meta], T], specification: Optional[Specification] = None, **settings) -> FunctionDataTask[T]:
 
     
@@ -78,7 +144,8 @@ def data(func: Callable[[Meta], T], specification: Optional[Specification] = Non
     if func is None:
         inner
     else:
-        return FunctionDataTask(func.__name__, func, specification, **settings)
+        return declare(FunctionDataTask(func.__name__, func, specification, **settings),
+                       func.__module__, func.__qualname__)
 
 
 
@@ -87,18 +154,86 @@ def task(func: Callable[..., T], specification: Optional[Specification] = None,
     def inner(name, dependencies):
         return FunctionDataTask(name, func, dependencies, specification, **settings)
     
-    nometa = tuple(arg for arg in func.__code__.co_varnames if arg != 'meta')
+    code = func.__code__
+    nometa = tuple(arg for arg in code.co_varnames[:code.co_argcount] if arg != 'meta')
         
     if func is None:
         inner
     else:
-        return FunctionTask(func.__name__, func, nometa, specification, **settings)
+        return declare(FunctionTask(func.__name__, func, nometa, specification, **settings),
+                       func.__module__, func.__qualname__)
     
 
 
+def _ndarray(value: Any) -> bool:
+    #numpy is optional: an upstream array means it is already imported
+    numpy = sys.modules.get('numpy')
+    return numpy is not None and isinstance(value, numpy.ndarray)
+
+
+def _vectorized(func: Callable, array: Any) -> Any:
+    #whole-array call of a callable declared as elementwise on arrays
+    result = func(array)
+    if not _ndarray(result) or result.shape[:1] != array.shape[:1]:
+        raise ValueError(f"vectorized function should return an array of {len(array)} elements, "
+                         f"got {getattr(result, 'shape', type(result))}")
+    return result
+
+
+def chunks(iterable: Iterable[T], chunk_size: int) -> Iterator[list[T]]:
+    #pulls at most chunk_size elements from the source at a time
+    iterator = iter(iterable)
+    while chunk := list(islice(iterator, chunk_size)):
+        yield chunk
+
+
+class MapTaskError(Exception):
+    #raised by MapTask when func fails, index is the position of the element in the input
+    def __init__(self, index: int, error: BaseException):
+        super().__init__(index, error)
+        self.index = index
+        self.error = error
+
+    def __str__(self):
+        return f"map function failed on element {self.index}: {self.error!r}"
+
+
+def _map_chunk(func: Callable, start: int, chunk: list) -> list:
+    #runs in pool workers too, so it only gets picklable arguments
+    results = []
+    for i, element in enumerate(chunk):
+        try:
+            results.append(func(element))
+        except Exception as e:
+            raise MapTaskError(start + i, e) from e
+    return results
+
+
 class MapTask(Task[Iterator[T]]):
-    def __init__(self, func: Callable, dependence : Union[str, "Task"]):
+    """
+    Streaming tasks: the output is a generator pulling the upstream iterator chunk by chunk,
+    so chains of map/filter tasks hold at most chunk_size elements per stage in memory
+    and reduce consumes the chain as a fold.
+
+    With workers > 1 the chunks of MapTask are mapped in a process pool (func has to be
+    picklable), at most 2 * workers chunks are in flight; ordered=False yields chunks
+    as soon as they are ready instead of in input order.
+
+    With vectorize=True func/key is declared to work elementwise on arrays: a NumPy array
+    from upstream is passed to it as a whole (it returns a boolean mask for filter) and
+    an array is returned, ValueError is raised if the result does not match the array length.
+    Reduce always uses ufunc.reduce for arrays.
+    """
+    CHUNK_SIZE = 1024
+
+    def __init__(self, func: Callable, dependence : Union[str, "Task"], chunk_size: int = CHUNK_SIZE,
+                 workers: Optional[int] = None, ordered: bool = True, vectorize: bool = False):
         self.func = func
+        self.chunk_size = chunk_size
+        self.vectorize = vectorize
+        self.workers = workers
+        self.ordered = ordered
+        self.dependencies = (dependence,)
         
         if isinstance(dependence, str):
                 self.dependence_name = dependence
@@ -107,15 +242,58 @@ class MapTask(Task[Iterator[T]]):
         
         self._name = 'map_' + self.dependence_name
     
-    def transform(self, meta: Meta, /, **kwargs: Any) -> T:
-        return map(self._func, *(kwargs.values())) 
+    def transform(self, meta: Meta, /, **kwargs: Any) -> Iterator[T]:
+        source, = kwargs.values()
+        if self.vectorize and _ndarray(source):
+            return _vectorized(self.func, source)
+        return self._map(source)
+
+    def _map(self, source: Iterable) -> Iterator[T]:
+        if self.workers is None or self.workers <= 1:
+            start = 0
+            for chunk in chunks(source, self.chunk_size):
+                yield from _map_chunk(self.func, start, chunk)
+                start += len(chunk)
+        else:
+            yield from self._parallel_map(source)
+
+    def _parallel_map(self, source: Iterable) -> Iterator[T]:
+        from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+        executor = ProcessPoolExecutor(max_workers=self.workers)
+        pending = deque()
+        batches = chunks(source, self.chunk_size)
+        start = 0
+        try:
+            while True:
+                while len(pending) < 2 * self.workers:
+                    chunk = next(batches, None)
+                    if chunk is None:
+                        break
+                    pending.append(executor.submit(_map_chunk, self.func, start, chunk))
+                    start += len(chunk)
+                if not pending:
+                    break
+
+                if self.ordered:
+                    future = pending.popleft()
+                else:
+                    done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                    future = done.pop()
+                    pending.remove(future)
+                yield from future.result()
+        finally:
+            executor.shutdown(cancel_futures=True)
 
 
 
 class FilterTask(Task[Iterator[T]]):
-    def __init__(self, key: Callable, dependence: Union[str, "Task"]):
+    def __init__(self, key: Callable, dependence: Union[str, "Task"], chunk_size: int = MapTask.CHUNK_SIZE,
+                 vectorize: bool = False):
         
         self.key = key
+        self.chunk_size = chunk_size
+        self.vectorize = vectorize
+        self.dependencies = (dependence,)
         
         if isinstance(dependence, str):
                 self.dependence_name = dependence
@@ -124,13 +302,26 @@ class FilterTask(Task[Iterator[T]]):
         
         self._name = 'filter_' + self.dependence_name
         
-    def transform(self, meta: Meta, /, **kwargs: Any) -> T:
-        return filter(self.key, kwargs[self.dependence_name])
+    def transform(self, meta: Meta, /, **kwargs: Any) -> Iterator[T]:
+        source, = kwargs.values()
+        if self.vectorize and _ndarray(source):
+            mask = _vectorized(self.key, source)
+            if mask.dtype != bool or mask.ndim != 1:
+                raise ValueError(f"vectorized filter key should return a 1-d boolean mask, got {mask.dtype} {mask.shape}")
+            return source[mask]
+        return self._filter(source)
+
+    def _filter(self, source: Iterable) -> Iterator[T]:
+        for chunk in chunks(source, self.chunk_size):
+            yield from filter(self.key, chunk)
 
-class ReduceTask(Task[Iterator[T]]):
-    def __init__(self, func: Callable, dependence: Union[str, "Task"]):
+class ReduceTask(Task[T]):
+    def __init__(self, func: Callable, dependence: Union[str, "Task"], *initial: T):
         
         self.func = func
+        #optional initial value of the fold, as for functools.reduce
+        self.initial = initial[:1]
+        self.dependencies = (dependence,)
         
         if isinstance(dependence, str):
                 self.dependence_name = dependence
@@ -141,4 +332,10 @@ class ReduceTask(Task[Iterator[T]]):
         
     
     def transform(self, meta: Meta, /, **kwargs: Any) -> T:
-        return reduce(self.func, kwargs[self.dependence_name])
+        source, = kwargs.values()
+        numpy = sys.modules.get('numpy')
+        if _ndarray(source) and isinstance(self.func, numpy.ufunc):
+            if self.initial:
+                return self.func.reduce(source, axis=0, initial=self.initial[0])
+            return self.func.reduce(source, axis=0)
+        return reduce(self.func, source, *self.initial)
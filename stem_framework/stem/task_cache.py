@@ -0,0 +1,298 @@
+"""
+Persistent content-addressed cache of task results. A result is stored under a key built from the task path in its workspace, the code of the task, the meta passed to it and the results of its dependencies, so changing any of them leads to recomputation.
+"""
+import hashlib
+import marshal
+import os
+import pickle
+import sys
+from collections import OrderedDict
+from functools import lru_cache
+from collections.abc import Iterator
+from pathlib import Path
+from typing import Any, Optional, Union, Iterable
+
+from meta import Meta, freeze_meta
+from task import Task
+from task_tree import TaskNode
+
+
+def task_path(task_node: TaskNode) -> str:
+    return f"{task_node.workspace.name}.{task_node.task.name}"
+
+
+#task attributes not hashed by code_digest: they are covered by the task path and the dependency results
+_UNHASHED_ATTRIBUTES = frozenset(('_name', 'dependencies', 'dependence_name', '_stem_workspace'))
+
+
+@lru_cache(maxsize=None)
+def _class_source(cls: type) -> bytes:
+    import inspect
+    try:
+        return inspect.getsource(cls).encode()
+    except (OSError, TypeError):
+        return cls.__qualname__.encode()
+
+
+def _value_source(value: Any, seen: set) -> Optional[bytes]:
+    #stable bytes of a task attribute: code, defaults and closure of functions, pickle of other values;
+    #None if the value can not be hashed reliably
+    if hasattr(value, '__func__'):
+        #bound method: the function and the object it is bound to
+        func, owner = _value_source(value.__func__, seen), _value_source(value.__self__, seen)
+        return None if func is None or owner is None else func + owner
+    code = getattr(value, '__code__', None)
+    if code is None:
+        #builtins, ufuncs and module level callables are pickled by reference
+        try:
+            return pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+        except (pickle.PicklingError, TypeError, AttributeError):
+            return None
+    if id(value) in seen:
+        #recursive function referring to itself through its closure
+        return b''
+    seen.add(id(value))
+    try:
+        captured = [cell.cell_contents for cell in value.__closure__ or ()]
+    except ValueError:
+        #a closure cell which is not filled yet
+        return None
+    parts = [marshal.dumps(code)]
+    for captured_value in (value.__defaults__, value.__kwdefaults__, *captured):
+        source = _value_source(captured_value, seen)
+        if source is None:
+            return None
+        parts.append(source)
+    return b'\0'.join(parts)
+
+
+def code_digest(task: Task) -> Optional[str]:
+    #code of the task class and of its callable (_func of @task/@data, func/key of map, filter
+    #and reduce) with the values it captures and the other settings of the task;
+    #None if some of them can not be hashed, such calls are not cached
+    #proxies created by Workspace delegate to the original task
+    task = getattr(task, '_task', task)
+    parts = [sys.version.encode(), _class_source(type(task))]
+    seen = set()
+    for name, value in sorted(vars(task).items()):
+        if name in _UNHASHED_ATTRIBUTES:
+            continue
+        source = _value_source(value, seen)
+        if source is None:
+            return None
+        parts.append(name.encode() + b'=' + source)
+    return hashlib.sha256(b'\n'.join(parts)).hexdigest()
+
+
+def meta_digest(meta: Meta) -> Optional[str]:
+    frozen = repr(freeze_meta(meta))
+    #values hashed by identity are not stable between runs
+    if "('id', " in frozen:
+        return None
+    return hashlib.sha256(frozen.encode()).hexdigest()
+
+
+def result_digest(result: Any) -> Optional[str]:
+    try:
+        return hashlib.sha256(pickle.dumps(result, pickle.HIGHEST_PROTOCOL)).hexdigest()
+    except (pickle.PicklingError, TypeError, AttributeError):
+        return None
+
+
+class ResultCache:
+    """
+    On-disk cache of pickled task results with size-bounded LRU eviction.
+    Results that can not be pickled (iterators, generators, open files) are never cached.
+    """
+    DEFAULT_MAX_SIZE = 1024*1024*1024 # 1 Gb
+    SUFFIX = '.pkl'
+
+    def __init__(self, path: Union[str, Path], max_size: int = DEFAULT_MAX_SIZE,
+                 refresh: Iterable[Task] = ()):
+        self.path = Path(path)
+        self.path.mkdir(parents=True, exist_ok=True)
+        self.max_size = max_size
+        #tasks which are recomputed (and stored again) ignoring cached results
+        self.refresh = set(refresh)
+        self.hits = 0
+        self.misses = 0
+        self._entries: OrderedDict[str, int] = OrderedDict()
+        files = sorted(self.path.glob('*' + self.SUFFIX), key=lambda f: f.stat().st_mtime)
+        for f in files:
+            self._entries[f.stem] = f.stat().st_size
+        self._size = sum(self._entries.values())
+        #digests of results seen in the current run by id; a result is hashed once however many dependents it has
+        self._digests: Optional[dict[int, tuple[Any, Optional[str]]]] = None
+
+    @staticmethod
+    def default_path() -> Path:
+        return Path(os.environ.get('STEM_CACHE_DIR', Path.home() / '.cache' / 'stem'))
+
+    @property
+    def size(self) -> int:
+        return self._size
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def start_run(self):
+        self._digests = {}
+
+    def finish_run(self, completed: bool = True):
+        self._digests = None
+
+    def result_digest(self, result: Any) -> Optional[str]:
+        if self._digests is None:
+            return result_digest(result)
+        known = self._digests.get(id(result))
+        if known is not None and known[0] is result:
+            return known[1]
+        digest = result_digest(result)
+        self._digests[id(result)] = (result, digest)
+        return digest
+
+    def key(self, task_node: TaskNode, meta: Meta, kwargs: dict[str, Any]) -> Optional[str]:
+        digest = meta_digest(meta)
+        code = code_digest(task_node.task)
+        if digest is None or code is None:
+            return None
+        parts = [task_path(task_node), code, digest]
+        for name in sorted(kwargs):
+            dependency_digest = self.result_digest(kwargs[name])
+            if dependency_digest is None:
+                return None
+            parts.append(f"{name}={dependency_digest}")
+        return hashlib.sha256('\n'.join(parts).encode()).hexdigest()
+
+    def _file(self, key: str) -> Path:
+        return self.path / (key + self.SUFFIX)
+
+    def get(self, key: str) -> tuple[bool, Any]:
+        if key not in self._entries:
+            return False, None
+        file = self._file(key)
+        try:
+            with open(file, 'rb') as f:
+                result = pickle.load(f)
+        except (OSError, EOFError, pickle.UnpicklingError):
+            self._discard(key)
+            return False, None
+        self._entries.move_to_end(key)
+        os.utime(file)
+        return True, result
+
+    def put(self, key: str, result: Any) -> bool:
+        try:
+            payload = pickle.dumps(result, pickle.HIGHEST_PROTOCOL)
+        except (pickle.PicklingError, TypeError, AttributeError):
+            return False
+        if len(payload) > self.max_size:
+            return False
+
+        if self._digests is not None:
+            #the stored result is hashed from the same payload when its dependents look up
+            self._digests[id(result)] = (result, hashlib.sha256(payload).hexdigest())
+
+        file = self._file(key)
+        tmp = file.with_suffix('.tmp')
+        with open(tmp, 'wb') as f:
+            f.write(payload)
+        os.replace(tmp, file)
+
+        self._discard_entry(key)
+        self._entries[key] = len(payload)
+        self._size += len(payload)
+        self._evict()
+        return True
+
+    def _discard_entry(self, key: str):
+        size = self._entries.pop(key, None)
+        if size is not None:
+            self._size -= size
+
+    def _discard(self, key: str):
+        self._discard_entry(key)
+        self._file(key).unlink(missing_ok=True)
+
+    def _evict(self):
+        while self._size > self.max_size and self._entries:
+            oldest = next(iter(self._entries))
+            self._discard(oldest)
+
+    def clear(self):
+        for key in list(self._entries):
+            self._discard(key)
+
+    def lookup(self, task_node: TaskNode, meta: Meta, kwargs: dict[str, Any]) -> tuple[Optional[str], bool, Any]:
+        #returns (key, found, result); key is None for calls that can not be cached
+        key = self.key(task_node, meta, kwargs)
+        if key is not None and task_node.task not in self.refresh:
+            found, result = self.get(key)
+            if found:
+                self.hits += 1
+                return key, True, result
+        self.misses += 1
+        return key, False, None
+
+    def store(self, key: Optional[str], result: Any) -> bool:
+        if key is None:
+            return False
+        return self.put(key, result)
+
+
+class IncrementalCache:
+    """
+    In-memory results of the previous run, used by TaskMaster(incremental=True).
+    A call is reused when the node got the same meta as in the previous run and all its
+    dependency results are the very objects of the previous run, i.e. none of them was
+    recomputed; otherwise it is dirty and the lookup goes to the persistent cache, if any.
+    Iterator results (map/filter streams) are consumed by the run, so they are never reused.
+    """
+
+    def __init__(self, cache: Optional[ResultCache] = None, refresh: Iterable[Task] = ()):
+        self.cache = cache
+        #tasks whose previous results are not reused
+        self.refresh = set(refresh)
+        self.recomputed: list[TaskNode] = []
+        self._previous: dict[tuple, tuple[dict[str, Any], Any]] = {}
+        self._current: dict[tuple, tuple[dict[str, Any], Any]] = {}
+
+    def start_run(self):
+        self.recomputed = []
+        self._current = {}
+        if self.cache is not None:
+            self.cache.start_run()
+
+    def finish_run(self, completed: bool = True):
+        #results of a failed run are not reused
+        if completed:
+            self._previous = self._current
+        self._current = {}
+        if self.cache is not None:
+            self.cache.finish_run(completed)
+
+    def lookup(self, task_node: TaskNode, meta: Meta, kwargs: dict[str, Any]) -> tuple[Any, bool, Any]:
+        call = (task_node, freeze_meta(meta))
+        previous = self._previous.get(call)
+        refreshed = task_node.task in self.refresh or \
+            (self.cache is not None and task_node.task in self.cache.refresh)
+        if previous is not None and not refreshed and not isinstance(previous[1], Iterator):
+            previous_kwargs, result = previous
+            if previous_kwargs.keys() == kwargs.keys() and \
+                    all(kwargs[name] is previous_kwargs[name] for name in kwargs):
+                self._current[call] = previous
+                return (call, kwargs, None), True, result
+
+        key, found, result = (None, False, None) if self.cache is None \
+            else self.cache.lookup(task_node, meta, kwargs)
+        if found:
+            self._current[call] = (kwargs, result)
+        return (call, kwargs, key), found, result
+
+    def store(self, key: tuple, result: Any) -> bool:
+        call, kwargs, cache_key = key
+        self._current[call] = (kwargs, result)
+        self.recomputed.append(call[0])
+        if self.cache is None:
+            return False
+        return self.cache.store(cache_key, result)
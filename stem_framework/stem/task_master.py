@@ -1,14 +1,18 @@
 from enum import Enum, auto
-from typing import Optional, Callable, TypeVar, Generic
+from typing import Optional, Callable, TypeVar, Generic, TYPE_CHECKING
 from functools import cached_property
 from dataclasses import dataclass, field
 
 from meta import Meta, MetaVerification, Specification
 from task import Task
-from workspace import Workspace
+from workspace import Workspace, IWorkspace
 from task_runner import TaskRunner, SimpleRunner
 from task_tree import TaskNode, TaskTree
 
+if TYPE_CHECKING:
+    from task_cache import ResultCache
+    from task_profiler import Profiler
+
 T = TypeVar("T")
 
 
@@ -58,18 +62,59 @@ class TaskResult(Generic[T]):
 
 class TaskMaster:
 
-    def __init__(self, task_runner: TaskRunner[T] = SimpleRunner(), task_tree: Optional[TaskTree] = None):
-        self.task_runner = task_runner
+    def __init__(self, task_runner: Optional[TaskRunner[T]] = None, task_tree: Optional[TaskTree] = None,
+                 cache: Optional["ResultCache"] = None, incremental: bool = False,
+                 profiler: Optional["Profiler"] = None):
+        self.task_runner = SimpleRunner() if task_runner is None else task_runner
         self.task_tree = task_tree
+        self.cache = cache
+        #incremental mode reuses results of the previous run for unchanged calls
+        self.incremental = None
+        if incremental:
+            from task_cache import IncrementalCache
+            self.incremental = IncrementalCache(cache)
+        self.task_runner.cache = cache if self.incremental is None else self.incremental
+        self.profiler = profiler
+        self.task_runner.profiler = profiler
+        #compiled plans of roots executed without an explicit task_tree, valid for one index generation
+        self._trees: dict[tuple, TaskTree] = {}
+        self._trees_generation = IWorkspace._index_generation
+
+    def resolve_node(self, task: Task[T], workspace: Optional[Workspace] = None) -> TaskNode[T]:
+        if self.task_tree is not None:
+            return self.task_tree.resolve_node(task, workspace)
+
+        if self._trees_generation != IWorkspace._index_generation:
+            #tasks or workspaces changed: the plans may resolve dependencies to replaced tasks
+            self._trees = {}
+            self._trees_generation = IWorkspace._index_generation
+        key = (task, workspace)
+        tree = self._trees.get(key)
+        if tree is None:
+            tree = self._trees[key] = TaskTree(task, workspace)
+        return tree.root
+
+    @property
+    def recomputed(self) -> list[TaskNode]:
+        #nodes transformed in the last incremental run (others were reused)
+        return [] if self.incremental is None else self.incremental.recomputed
+
+    def _run(self, meta: Meta, task_node: TaskNode[T]) -> T:
+        cache = self.task_runner.cache
+        if cache is None:
+            return self.task_runner.run(meta, task_node)
+        cache.start_run()
+        completed = False
+        try:
+            result = self.task_runner.run(meta, task_node)
+            completed = True
+            return result
+        finally:
+            cache.finish_run(completed)
 
     def execute(self, meta: Meta, task: Task[T], workspace: Optional[Workspace] = None) -> TaskResult[T]:
         
-        
-        if self.task_tree is None:
-            task_node = TaskNode(task, workspace) 
-        else:            
-            task_node = self.task_tree.resolve_node(task, workspace)
-        
+        task_node = self.resolve_node(task, workspace)
 
         if task_node.has_dependence_errors:
             return TaskResult(status = TaskStatus.DEPENDENCIES_ERROR,task_node = task_node)
@@ -78,8 +123,8 @@ class TaskMaster:
             ver = MetaVerification.verify(meta, task.specification)
             if not ver.checked_success:
                 return TaskResult(status = TaskStatus.META_ERROR, task_node = task_node,
-                    TaskMetaError(task_node, ver) )
+                    meta_errors = TaskMetaError(task_node, ver) )
             
 
         return TaskResult(status = TaskStatus.CONTAINS_DATA, task_node = task_node,
-                          lazy_data = lambda: self.task_runner.run(meta, task_node) )
\ No newline at end of file
+                          lazy_data = lambda: self._run(meta, task_node) )
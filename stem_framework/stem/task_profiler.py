@@ -0,0 +1,135 @@
+"""
+Per-task execution profile of TaskMaster runs, exported as a text report or in Chrome trace-event format (chrome://tracing, Perfetto).
+"""
+import json
+import os
+import sys
+import threading
+import time
+import tracemalloc
+from dataclasses import dataclass, asdict
+from typing import Any, Callable, Optional, TypeVar
+
+from task_tree import TaskNode
+
+T = TypeVar("T")
+
+
+@dataclass
+class TaskProfile:
+    name: str = ''
+    start: float = 0.0 # epoch seconds
+    wall_time: float = 0.0
+    cpu_time: float = 0.0
+    memory_peak: Optional[int] = 0 # bytes allocated over the memory in use before the transform, None if not measured
+    result_size: int = 0
+    wait_time: float = 0.0 # from the start of the work on its dependencies (or from when it could run) until its transform started
+    pid: int = 0
+    tid: int = 0
+    cached: bool = False # result taken from the cache, the transform did not run
+
+
+def result_size(result: Any) -> int:
+    nbytes = getattr(result, 'nbytes', None)
+    if isinstance(nbytes, int):
+        return nbytes
+    return sys.getsizeof(result)
+
+
+class Measure:
+    #context manager filling a TaskProfile; works in pool workers as well
+    def __init__(self, memory: bool = True):
+        #tracemalloc peak is process-wide: memory is measured only when transforms do not overlap
+        self.memory = memory
+        self.profile = TaskProfile(pid=os.getpid(), tid=threading.get_ident(), memory_peak=None)
+
+    def __enter__(self) -> "Measure":
+        if self.memory:
+            self._started = not tracemalloc.is_tracing()
+            if self._started:
+                tracemalloc.start()
+            self._memory, _ = tracemalloc.get_traced_memory()
+            tracemalloc.reset_peak()
+        self.profile.start = time.time()
+        self._wall = time.perf_counter()
+        self._cpu = time.thread_time()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.profile.cpu_time = time.thread_time() - self._cpu
+        self.profile.wall_time = time.perf_counter() - self._wall
+        if self.memory:
+            _, peak = tracemalloc.get_traced_memory()
+            self.profile.memory_peak = max(peak - self._memory, 0)
+            if self._started:
+                tracemalloc.stop()
+
+
+def measure(func: Callable[..., T], *args, memory: bool = True, **kwargs) -> tuple[T, TaskProfile]:
+    with Measure(memory) as m:
+        result = func(*args, **kwargs)
+    m.profile.result_size = result_size(result)
+    return result, m.profile
+
+
+class Profiler:
+    """
+    Collects TaskProfile records from runners. CPU time is the time of the thread
+    running the transform; coroutine CPU times overlap, so they are upper estimates.
+    The tracemalloc peak is process-wide, so memory is not measured per task when
+    transforms share a process (thread pools, AsyncRunner): it is reported as n/a.
+    Cache hits are recorded with zero time.
+    """
+
+    def __init__(self):
+        self.records: list[TaskProfile] = []
+        self._lock = threading.Lock()
+
+    def record(self, task_node: TaskNode, profile: TaskProfile, requested: Optional[float] = None):
+        profile.name = f"{task_node.workspace.name}.{task_node.task.name}"
+        if requested is not None:
+            profile.wait_time = max(profile.start - requested, 0.0)
+        with self._lock:
+            self.records.append(profile)
+
+    def record_cached(self, task_node: TaskNode, result: Any, requested: Optional[float] = None):
+        now = time.time()
+        profile = TaskProfile(start=now, result_size=result_size(result), pid=os.getpid(),
+                              tid=threading.get_ident(), cached=True)
+        self.record(task_node, profile, now if requested is None else requested)
+
+    def clear(self):
+        self.records = []
+
+    def chrome_trace(self) -> dict:
+        events = []
+        for r in self.records:
+            events.append({
+                "name": r.name, "cat": "cache" if r.cached else "task", "ph": "X",
+                "ts": r.start * 1e6, "dur": r.wall_time * 1e6,
+                "pid": r.pid, "tid": r.tid,
+                "args": {k: v for k, v in asdict(r).items() if k not in ("name", "start", "pid", "tid")},
+            })
+            if r.wait_time > 0:
+                events.append({
+                    "name": f"wait {r.name}", "cat": "wait", "ph": "X",
+                    "ts": (r.start - r.wait_time) * 1e6, "dur": r.wait_time * 1e6,
+                    "pid": r.pid, "tid": r.tid,
+                })
+        return {"traceEvents": events, "displayTimeUnit": "ms"}
+
+    def write_chrome_trace(self, path):
+        with open(path, 'w') as f:
+            json.dump(self.chrome_trace(), f)
+
+    def report(self) -> str:
+        header = f"{'task':<40} {'wall, s':>10} {'cpu, s':>10} {'wait, s':>10} {'mem peak, B':>14} {'result, B':>12}"
+        lines = [header, '-' * len(header)]
+        for r in sorted(self.records, key=lambda r: r.wall_time, reverse=True):
+            memory = 'n/a' if r.memory_peak is None else r.memory_peak
+            lines.append(f"{r.name:<40} {r.wall_time:>10.4f} {r.cpu_time:>10.4f} {r.wait_time:>10.4f} "
+                         f"{memory:>14} {r.result_size:>12}" + (' cached' if r.cached else ''))
+        lines.append('-' * len(header))
+        lines.append(f"{'total':<40} {sum(r.wall_time for r in self.records):>10.4f} "
+                     f"{sum(r.cpu_time for r in self.records):>10.4f}")
+        return '\n'.join(lines)
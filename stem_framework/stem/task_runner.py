@@ -1,143 +1,400 @@
 import os
-import asyncio
-import threading
-from typing import Generic, TypeVar
+import time
+from collections import Counter
+from collections.abc import Iterator
+from contextlib import nullcontext
+from dataclasses import dataclass, field
+from functools import partial
+from itertools import tee
+from typing import Generic, TypeVar, Any, Hashable, Iterable, Optional, TYPE_CHECKING
 from abc import ABC, abstractmethod
 
-from meta import Meta, get_meta_attr
+from meta import Meta, get_meta_attr, freeze_meta
+from task import Task
 from task_tree import TaskNode
 
-
-from collections import deque
-from multiprocessing import Process
+#asyncio, concurrent.futures (multiprocessing) and the profiler are imported
+#by the runners using them, so loading this module stays cheap for the CLI
+if TYPE_CHECKING:
+    from concurrent.futures import Executor
 
 T = TypeVar("T")
-class TaskRunner(ABC, Generic[T]):
-    @abstractmethod
-    def run(self, meta: Meta, task_node: TaskNode[T]) -> T:
-        pass
-
-class SimpleRunner(TaskRunner[T]):
-    def run(self, meta: Meta, task_node: TaskNode[T]) -> T:
-        assert not task_node.has_dependence_errors
-
-        kwargs = {t.task.name: self.run(get_meta_attr(meta, t.task.name, {}), t) for t in task_node.dependencies}
 
-        return task_node.task.transform(meta, **kwargs)
 
+@dataclass
+class TaskCall(Generic[T]):
+    #one transform to compute: the node with the meta subtree it receives
+    task_node: TaskNode[T]
+    meta: Meta
+    dependencies: dict[str, Hashable] = field(default_factory=dict)
+    cache_key: Optional[str] = None
+
+
+def expand_calls(meta: Meta, task_node: TaskNode[T]) -> tuple[Hashable, dict[Hashable, TaskCall]]:
+    """
+    Unfolds the compiled plan of task_node into distinct (node, meta subtree) calls.
+    Calls are keyed by node and frozen meta, so shared dependencies appear once.
+    """
+    root = (task_node, freeze_meta(meta))
+    calls = {root: TaskCall(task_node, meta)}
+    stack = [root]
+    while stack:
+        call = calls[stack.pop()]
+        for name, dependency in call.task_node.named_dependencies:
+            dependency_meta = get_meta_attr(call.meta, name, {})
+            key = (dependency, freeze_meta(dependency_meta))
+            call.dependencies[name] = key
+            if key not in calls:
+                calls[key] = TaskCall(dependency, dependency_meta)
+                stack.append(key)
+    return root, calls
+
+
+def call_order(root: Hashable, calls: dict[Hashable, TaskCall]) -> list[Hashable]:
+    #keys of the calls with dependencies before dependents (iterative post-order DFS)
+    order, visited = [], set()
+    stack = [(root, False)]
+    while stack:
+        key, expanded = stack.pop()
+        if expanded:
+            order.append(key)
+            continue
+        if key in visited:
+            continue
+        visited.add(key)
+        stack.append((key, True))
+        for dependency in calls[key].dependencies.values():
+            if dependency not in visited:
+                stack.append((dependency, False))
+    return order
+
+
+def consumers(root: Hashable, calls: dict[Hashable, TaskCall]) -> Counter:
+    #number of kwargs (plus the caller for the root) each call result is passed to
+    counts = Counter(key for call in calls.values() for key in call.dependencies.values())
+    counts[root] += 1
+    return counts
+
+
+def requested_since(requested: Iterable[float], ready: float) -> float:
+    #a call waits for its dependencies from the moment the work on its dependency subtree began:
+    #the earliest request time of its dependencies, or the moment it could run if it has none
+    return min(requested, default=ready)
+
+
+def share(result: Any, count: int, concurrent: bool = False) -> list:
+    #one object per consumer: a one-shot iterator is tee'd so every consumer reads all of it;
+    #tee objects can not be read from several threads, concurrent consumers share a list
+    if count > 1 and isinstance(result, Iterator):
+        if concurrent:
+            return [list(result)] * count
+        return list(tee(result, count))
+    return [result] * count
+
+
+def materialize(value: Any) -> Any:
+    #iterators (generators of map/filter tasks) can not be pickled to other processes
+    return list(value) if isinstance(value, Iterator) else value
+
+
+def _transform(task: Task[T], meta: Meta, kwargs: dict[str, Any], materialized: bool = False) -> T:
+    #executed in the pool workers: only the task itself is sent to other processes
+    if task.is_coroutine:
+        #coroutine tasks outside of AsyncRunner get an event loop of their own
+        import asyncio
+        result = asyncio.run(task.transform(meta, **kwargs))
+    else:
+        result = task.transform(meta, **kwargs)
+    return materialize(result) if materialized else result
+
+
+def _measured_transform(task: Task[T], meta: Meta, kwargs: dict[str, Any], materialized: bool = False,
+                        memory: bool = True):
+    #profiled variant of _transform, returns (result, task_profiler.TaskProfile)
+    from task_profiler import measure
+    return measure(_transform, task, meta, kwargs, materialized, memory=memory)
 
-class ProcessingRunner(TaskRunner[T]):
-    MAX_WORKERS = os.cpu_count()
 
-    activeThreadsTasks = deque()
-
-    threadsContent = dict()
-
-    def _task_in_thread(self, number, task_node, meta, **kwargs):
-        self.threadsContent[number] = task_node.task.transform(task_node, meta, **kwargs)
-
-    def _thread_running(self, task_node: TaskNode[T], meta: Meta, **kwargs):
-        thread_number = len(self.activeThreadsTasks)
-        thread = threading.Thread(target=task_node.task.transform, args=(task_node, meta, *kwargs))
-        self.activeThreadsTasks.append(thread)
-        self.threadsContent[thread_number] = None
-        thread.start()
-        thread.join()
-        ret = self.threadsContent[thread_number]
-        self.activeThreadsTasks.remove(thread)
-        self.threadsContent.pop(thread_number)
-        return ret
-
-    def _start_thread_run(self, task_node: TaskNode[T], meta: Meta, **kwargs) -> T:
-        result: T
-        if len(self.activeThreadsTasks) < self.MAX_WORKERS:
-            result = self._thread_running(task_node=task_node, meta=meta, **kwargs)
-        else:
-            while True:
-                if len(self.activeThreadsTasks) < self.MAX_WORKERS:
-                    result = self._thread_running(task_node=task_node, meta=meta, **kwargs)
-                    break
-                time.sleep(0.1)
-
-        assert result is not None
-        return result
+class TaskRunner(ABC, Generic[T]):
+    #optional task_cache.ResultCache, installed by TaskMaster
+    cache = None
+    #optional task_profiler.Profiler, installed by TaskMaster
+    profiler = None
 
+    @abstractmethod
     def run(self, meta: Meta, task_node: TaskNode[T]) -> T:
-        kwargs = {t.task.name: self.run(get_meta_attr(meta, t.task.name, {}), t) for t in task_node.dependencies}
+        pass
 
-        result: T = None
-        if len(task_node.dependencies) == 0:
-            result = self._start_thread_run(task_node=task_node, meta=meta, **kwargs)
-        assert result is not None
+    def _cached(self, task_node: TaskNode[T], result: T, requested: Optional[float] = None) -> T:
+        #cache hits show up in the profile with zero time
+        if self.profiler is not None:
+            self.profiler.record_cached(task_node, result, requested)
         return result
 
+    def transform(self, task_node: TaskNode[T], meta: Meta, kwargs: dict[str, Any],
+                  requested: Optional[float] = None) -> T:
+        #requested is given by requested_since, the profiler reports the wait since then
+        if self.cache is not None:
+            key, found, result = self.cache.lookup(task_node, meta, kwargs)
+            if found:
+                return self._cached(task_node, result, requested)
 
-class AsyncRunner(TaskRunner[T]):
-    loop = asyncio.get_event_loop()
+        if self.profiler is None:
+            result = _transform(task_node.task, meta, kwargs)
+        else:
+            result, profile = _measured_transform(task_node.task, meta, kwargs)
+            self.profiler.record(task_node, profile, requested)
 
-    def run(self, meta: Meta, task_node: TaskNode[T]) -> T:
-        result = self.loop.run_until_complete(self._make_tasks(meta, task_node))
-        self.loop.close()
+        if self.cache is not None:
+            self.cache.store(key, result)
         return result
 
-    async def _make_tasks(self, meta: Meta, task_node: TaskNode[T]) -> list[T]:
-        await asyncio.sleep(0)
-        kwargs = {t.task.name: self.loop.create_task(self._make_tasks(get_meta_attr(meta, t.task.name, {}), t)) for t in task_node.dependencies}
-
-        for t in task_node.dependencies:
-            await kwargs[t.task.name]
-
-        result: T = None
-        if len(task_node.dependencies) == 0:
-            result = await self._async_transform(task_node, meta)
-        assert result is not None
-        return result
+class SimpleRunner(TaskRunner[T]):
+    """
+    Sequential runner walking the dependency graph without recursion, so deep pipelines
+    do not hit the recursion limit. With memoize=True every distinct (task node, meta subtree)
+    pair is transformed only once per run, in the topological order of the calls, so
+    shared dependencies of a diamond-shaped graph are not recomputed; computations_saved
+    reports how many transforms were skipped. Without memoize every dependent gets a
+    result computed for it alone.
+    """
+
+    def __init__(self, memoize: bool = False):
+        self.memoize = memoize
+        self.computations_saved = 0
 
-    async def _async_transform(self, task_node: TaskNode[T], meta: Meta, **kwargs) -> T:
-        return task_node.task.transform(meta, **kwargs)
+    def run(self, meta: Meta, task_node: TaskNode[T]) -> T:
+        assert not task_node.has_dependence_errors
 
+        self.computations_saved = 0
+        if self.memoize:
+            return self._run_calls(meta, task_node)
+        return self._run_tree(meta, task_node)
+
+    def _run_calls(self, meta: Meta, task_node: TaskNode[T]) -> T:
+        root, calls = expand_calls(meta, task_node)
+        counts = consumers(root, calls)
+        order = call_order(root, calls)
+        #without memoize a call is transformed once per path from the root to it
+        paths = Counter({root: 1})
+        for key in reversed(order):
+            for dependency in calls[key].dependencies.values():
+                paths[dependency] += paths[key]
+        self.computations_saved = sum(paths.values()) - len(calls)
+        results = {}
+        requested = {}
+        for key in order:
+            call = calls[key]
+            kwargs = {name: results[k].pop() for name, k in call.dependencies.items()}
+            requested[key] = requested_since((requested[k] for k in call.dependencies.values()), time.time())
+            results[key] = share(self.transform(call.task_node, call.meta, kwargs, requested[key]), counts[key])
+        return results[root].pop()
+
+    def _run_tree(self, meta: Meta, task_node: TaskNode[T]) -> T:
+        #explicit stack of [node, meta, pending dependencies, kwargs, name in the parent, request times of dependencies]
+        stack = [[task_node, meta, iter(task_node.named_dependencies), {}, None, []]]
+        while True:
+            frame = stack[-1]
+            node, node_meta, pending, kwargs, name, requested = frame
+            dependency = next(pending, None)
+            if dependency is not None:
+                dependency_name, dependency_node = dependency
+                stack.append([dependency_node, get_meta_attr(node_meta, dependency_name, {}),
+                              iter(dependency_node.named_dependencies), {}, dependency_name, []])
+                continue
+
+            requested = requested_since(requested, time.time())
+            result = self.transform(node, node_meta, kwargs, requested)
+            stack.pop()
+            if not stack:
+                return result
+            stack[-1][3][name] = result
+            stack[-1][5].append(requested)
+
+
+class ParallelRunner(TaskRunner[T]):
+    """
+    Ready-queue scheduler over the dependency graph: every call whose dependencies are
+    computed is submitted to a thread pool (or a process pool with processes=True) at once,
+    so independent branches run simultaneously on up to max_workers workers.
+    Process workers send results back to the parent through the pool pipes,
+    so tasks, meta and results have to be picklable in that mode; iterators are turned
+    into lists on the way. Shared dependencies are computed once and their result is
+    passed to every dependent; an iterator with several dependents is turned into a list
+    by its worker, as dependents may read it from different threads.
+    """
+    def __init__(self, max_workers: Optional[int] = None, processes: bool = False):
+        self.max_workers = os.cpu_count() if max_workers is None else max_workers
+        self.processes = processes
+
+    def _executor(self) -> "Executor":
+        from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+        if self.processes:
+            return ProcessPoolExecutor(max_workers=self.max_workers)
+        return ThreadPoolExecutor(max_workers=self.max_workers)
 
-class ProcessingRunner(TaskRunner[T]):
-    MAX_WORKERS = os.cpu_count()
+    def run(self, meta: Meta, task_node: TaskNode[T]) -> T:
+        from concurrent.futures import FIRST_COMPLETED, wait
+        assert not task_node.has_dependence_errors
 
-    activeProcessTasks = deque()
+        start = time.time()
+        root, calls = expand_calls(meta, task_node)
+        counts = consumers(root, calls)
+        waiting = {key: len(set(call.dependencies.values())) for key, call in calls.items()}
+        dependents = {key: [] for key in calls}
+        for key, call in calls.items():
+            for dependency in set(call.dependencies.values()):
+                dependents[dependency].append(key)
+
+        ready = [key for key, count in waiting.items() if count == 0]
+        results = {}
+        requested = {}
+        with self._executor() as executor:
+            running = {}
+            try:
+                while ready or running:
+                    while ready:
+                        key = ready.pop()
+                        call = calls[key]
+                        kwargs = {name: results[k].pop() for name, k in call.dependencies.items()}
+                        #calls without dependencies are ready from the start of the run
+                        requested[key] = requested_since((requested[k] for k in call.dependencies.values()), start)
+                        if self.processes:
+                            kwargs = {name: materialize(value) for name, value in kwargs.items()}
+                        if self.cache is not None:
+                            call.cache_key, found, result = self.cache.lookup(call.task_node, call.meta, kwargs)
+                            if found:
+                                self._cached(call.task_node, result, requested[key])
+                                results[key] = share(result, counts[key], True)
+                                self._finish(key, dependents, waiting, ready)
+                                continue
+                        materialized = self.processes or counts[key] > 1
+                        if self.profiler is None:
+                            future = executor.submit(_transform, call.task_node.task, call.meta, kwargs, materialized)
+                        else:
+                            #threads of one process share the tracemalloc peak
+                            future = executor.submit(_measured_transform, call.task_node.task, call.meta, kwargs,
+                                                     materialized, self.processes)
+                        running[future] = key
+
+                    if not running:
+                        continue
+                    done, _ = wait(running, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        key = running.pop(future)
+                        result = future.result()
+                        if self.profiler is not None:
+                            result, profile = result
+                            self.profiler.record(calls[key].task_node, profile, requested[key])
+                        if self.cache is not None:
+                            self.cache.store(calls[key].cache_key, result)
+                        results[key] = share(result, counts[key], True)
+                        self._finish(key, dependents, waiting, ready)
+            except BaseException:
+                for future in running:
+                    future.cancel()
+                raise
+        return results[root].pop()
+
+    @staticmethod
+    def _finish(key, dependents: dict, waiting: dict, ready: list):
+        for dependent in dependents[key]:
+            waiting[dependent] -= 1
+            if waiting[dependent] == 0:
+                ready.append(dependent)
+
+
+class ProcessingRunner(ParallelRunner[T]):
+    #ParallelRunner over a process pool, for CPU-bound tasks
+    def __init__(self, max_workers: Optional[int] = None):
+        super().__init__(max_workers, processes=True)
 
-    processContent = dict()
 
-    def _task_in_process(self, number, task_node, meta, **kwargs):
-        self.processContent[number] = task_node.task.transform(task_node, meta, **kwargs)
+class AsyncRunner(TaskRunner[T]):
+    """
+    asyncio runner: coroutine tasks (async def under @task/@data) are awaited on the loop,
+    sync tasks are sent to the thread executor, independent dependencies are gathered
+    and at most max_concurrency transforms are in flight at once. Results with several
+    dependents are passed to them as lists, iterators are not shared between concurrent readers.
+    run() starts its own event loop; inside a running loop use await run_async().
+    """
+    def __init__(self, max_concurrency: Optional[int] = None, executor: Optional["Executor"] = None):
+        self.max_concurrency = max_concurrency
+        #None means the default executor of the event loop
+        self.executor = executor
 
-    def _process_running(self, task_node: TaskNode[T], meta: Meta, **kwargs):
-        process_number = len(self.activeProcessTasks)
-        process = Process(target=task_node.task.transform, args=(task_node, meta, *kwargs))
-        self.activeProcessTasks.append(process)
-        self.processContent[process_number] = None
-        process.start()
-        process.join()
-        ret = self.processContent[process_number]
-        self.activeProcessTasks.remove(process)
-        self.processContent.pop(process_number)
-        return ret
+    def run(self, meta: Meta, task_node: TaskNode[T]) -> T:
+        import asyncio
+        return asyncio.run(self.run_async(meta, task_node))
 
-    def _start_process_run(self, task_node: TaskNode[T], meta: Meta, **kwargs) -> T:
-        result: T
-        if len(self.activeProcessTasks) < self.MAX_WORKERS:
-            result = self._process_running(task_node=task_node, meta=meta, **kwargs)
-        else:
-            while True:
-                if len(self.activeProcessTasks) < self.MAX_WORKERS:
-                    result = self._process_running(task_node=task_node, meta=meta, **kwargs)
-                    break
-                time.sleep(0.1)
+    async def run_async(self, meta: Meta, task_node: TaskNode[T]) -> T:
+        import asyncio
+        assert not task_node.has_dependence_errors
 
-        assert result is not None
+        root, calls = expand_calls(meta, task_node)
+        counts = consumers(root, calls)
+        shares = {}
+        requested_at = {}
+        semaphore = nullcontext() if self.max_concurrency is None else asyncio.Semaphore(self.max_concurrency)
+        futures = {}
+
+        def result(key) -> asyncio.Future:
+            if key not in futures:
+                futures[key] = asyncio.ensure_future(compute(key))
+            return futures[key]
+
+        def take(key, value):
+            #every consumer gets an object of its own from the shared result
+            if key not in shares:
+                shares[key] = share(value, counts[key], True)
+            return shares[key].pop()
+
+        async def compute(key) -> T:
+            call = calls[key]
+            names = list(call.dependencies)
+            values = await asyncio.gather(*(result(call.dependencies[name]) for name in names))
+            kwargs = {name: take(call.dependencies[name], value) for name, value in zip(names, values)}
+            requested = requested_at[key] = \
+                requested_since((requested_at[k] for k in call.dependencies.values()), time.time())
+
+            if self.cache is not None:
+                call.cache_key, found, value = self.cache.lookup(call.task_node, call.meta, kwargs)
+                if found:
+                    return self._cached(call.task_node, value, requested)
+            async with semaphore:
+                value = await self._async_transform(call.task_node, call.meta, kwargs, requested,
+                                                    counts[key] > 1)
+            if self.cache is not None:
+                self.cache.store(call.cache_key, value)
+            return value
+
+        try:
+            return take(root, await result(root))
+        finally:
+            for future in futures.values():
+                future.cancel()
+
+    async def _async_transform(self, task_node: TaskNode[T], meta: Meta, kwargs: dict[str, Any],
+                               requested: Optional[float] = None, materialized: bool = False) -> T:
+        import asyncio
+        task = task_node.task
+        if task.is_coroutine:
+            if self.profiler is None:
+                result = await task.transform(meta, **kwargs)
+                return materialize(result) if materialized else result
+            from task_profiler import Measure, result_size
+            with Measure(memory=False) as m:
+                result = await task.transform(meta, **kwargs)
+                if materialized:
+                    result = materialize(result)
+            m.profile.result_size = result_size(result)
+            self.profiler.record(task_node, m.profile, requested)
+            return result
+
+        loop = asyncio.get_running_loop()
+        if self.profiler is None:
+            return await loop.run_in_executor(self.executor, partial(_transform, task, meta, kwargs, materialized))
+        result, profile = await loop.run_in_executor(self.executor, partial(_measured_transform, task, meta, kwargs,
+                                                                            materialized, memory=False))
+        self.profiler.record(task_node, profile, requested)
         return result
-
-    def run(self, meta: Meta, task_node: TaskNode[T]) -> T:
-        kwargs = {t.task.name: self.run(get_meta_attr(meta, t.task.name, {}), t) for t in task_node.dependencies}
-
-        result: T = None
-        if len(task_node.dependencies) == 0:
-            result = self._start_process_run(task_node=task_node, meta=meta, **kwargs)
-        assert result is not None
-        return result
\ No newline at end of file
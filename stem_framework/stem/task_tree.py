@@ -1,7 +1,7 @@
 from typing import TypeVar, Optional, Generic
 
 from task import Task
-from workspace import IWorkspace
+from workspace import IWorkspace, TaskPath
 
 T = TypeVar("T")
 
@@ -11,57 +11,144 @@ class TaskNode(Generic[T]):
     def __init__(self, task: Task[T], workspace: Optional[IWorkspace] = None):
         self.task = task
         self.workspace = IWorkspace.find_default_workspace(task) if workspace is None else workspace
+        #filled once by TaskTree (or lazily by _resolve for standalone nodes)
+        self._dependencies: Optional[tuple["TaskNode", ...]] = None
+        self._dependency_names: Optional[tuple[str, ...]] = None
+        self._unresolved: Optional[tuple[str, ...]] = None
+        self._has_dependence_errors: Optional[bool] = None
+
+    def _resolve(self):
+        if self._dependencies is None:
+            tree = TaskTree(self.task, self.workspace)
+            root = tree.root
+            self._dependencies = root._dependencies
+            self._dependency_names = root._dependency_names
+            self._unresolved = root._unresolved
+            self._has_dependence_errors = root._has_dependence_errors
+
+    @property
+    def dependencies(self) -> tuple["TaskNode", ...]:
+        self._resolve()
+        return self._dependencies
 
     @property
-    def dependencies(self) -> list["TaskNode"]:
-        resolved = []
-        for dependency in self.task.dependencies:
-            if self.workspace.has_task(dependency):
-                resolved.append(TaskNode(self.workspace.find_task(dependency), self.workspace) )
-        return resolved
+    def named_dependencies(self) -> tuple[tuple[str, "TaskNode"], ...]:
+        #names under which the task requested its dependencies (keys of transform kwargs)
+        self._resolve()
+        return tuple(zip(self._dependency_names, self._dependencies))
 
     @property
     def is_leaf(self) -> bool:
-        return self.dependencies == []
+        return len(self.dependencies) == 0
 
     @property
-    def unresolved_dependencies(self) -> list["str"]:
-        unresolved = []
-        for dependency in self.task.dependencies:
-            if not self.workspace.has_task(dependency):
-                unresolved.append(dependency)
-        return unresolved
+    def unresolved_dependencies(self) -> tuple[str, ...]:
+        self._resolve()
+        return self._unresolved
 
     @property
     def has_dependence_errors(self) -> bool:
-        if self.unresolved_dependencies:
-            return True
-        for dependency in self.dependencies:
-            if dependency.has_dependence_errors:
-                return True  
-        return False
+        self._resolve()
+        return self._has_dependence_errors
+
+    def __repr__(self):
+        return f"TaskNode({self.task.name})"
+
 
 class TaskTree:
+    """
+    Compiled dependency graph of a root task.
+
+    Every (task, workspace) pair is interned into a single TaskNode, dependencies are
+    resolved through the workspace only once, and the nodes are kept in topological
+    order (dependencies before dependents), so runners never walk the workspace again.
+    """
+
     def __init__(self, root: Task, workspace=None):
-        self.root = TaskNode(root, workspace)
+        self._nodes: dict[tuple, TaskNode] = {}
+        self.root = self._intern(root, workspace)
+        self.order = self._compile()
+        self.dependents: dict[TaskNode, tuple[TaskNode, ...]] = self._reverse_edges()
 
-    def find_task(self, task, workspace=None) -> TaskNode[T]:
+    def _intern(self, task: Task, workspace: Optional[IWorkspace]) -> TaskNode:
         _workspace = IWorkspace.find_default_workspace(task) if workspace is None else workspace
+        key = (task, _workspace)
+        node = self._nodes.get(key)
+        if node is None:
+            node = TaskNode(task, _workspace)
+            self._nodes[key] = node
+        return node
 
-        if task == self.root.task and self.root.workspace == _workspace:
-            return self.root
-        else:
-            for dependency in self.root.dependencies:
-                tree = TaskTree(dependency.task, dependency.workspace)
-                node = tree.find_task(task, workspace)
-                if node is not None:
-                    return node
-        return None        
-        
-    def resolve_node(self, task: Task[T], workspace: Optional[IWorkspace] = None) -> TaskNode[T]:
+    def _compile(self) -> tuple[TaskNode, ...]:
+        #iterative post-order DFS: deep pipelines don't hit the recursion limit
+        order = []
+        visiting = set()
+        visited = set()
+        stack = [(self.root, False)]
+        while stack:
+            node, expanded = stack.pop()
+            if expanded:
+                visiting.discard(node)
+                visited.add(node)
+                node._has_dependence_errors = node._has_dependence_errors or \
+                    bool(node._unresolved) or \
+                    any(d._has_dependence_errors for d in node._dependencies)
+                order.append(node)
+                continue
+            if node in visited or node in visiting:
+                continue
+            visiting.add(node)
+
+            resolved, names, unresolved = [], [], []
+            for dependency in node.task.dependencies:
+                if isinstance(dependency, Task):
+                    dependency_task, name = dependency, dependency.name
+                else:
+                    dependency_task = node.workspace.find_task(dependency)
+                    name = TaskPath(dependency).name
+                if dependency_task is None:
+                    unresolved.append(dependency)
+                else:
+                    resolved.append(self._intern(dependency_task, node.workspace))
+                    names.append(name)
+            node._dependencies = tuple(resolved)
+            node._dependency_names = tuple(names)
+            node._unresolved = tuple(unresolved)
+            #a dependency that is still being visited closes a cycle
+            node._has_dependence_errors = any(d in visiting for d in resolved)
+
+            stack.append((node, True))
+            for dependency in reversed(resolved):
+                if dependency not in visited and dependency not in visiting:
+                    stack.append((dependency, False))
+        return tuple(order)
+
+    def _reverse_edges(self) -> dict[TaskNode, tuple[TaskNode, ...]]:
+        dependents = {node: [] for node in self.order}
+        for node in self.order:
+            for dependency in node._dependencies:
+                dependents[dependency].append(node)
+        return {node: tuple(d) for node, d in dependents.items()}
+
+    @property
+    def nodes(self) -> tuple[TaskNode, ...]:
+        return self.order
+
+    @property
+    def leaves(self) -> tuple[TaskNode, ...]:
+        return tuple(node for node in self.order if not node._dependencies)
+
+    @property
+    def has_dependence_errors(self) -> bool:
+        return self.root._has_dependence_errors
+
+    def find_task(self, task, workspace=None) -> Optional[TaskNode[T]]:
         _workspace = IWorkspace.find_default_workspace(task) if workspace is None else workspace
-        node = self.find_task(task, _workspace)
+        return self._nodes.get((task, _workspace))
+
+    def resolve_node(self, task: Task[T], workspace: Optional[IWorkspace] = None) -> TaskNode[T]:
+        node = self.find_task(task, workspace)
         if node is None:
-            return TaskNode(task, workspace)
+            return TaskTree(task, workspace).root
         else:
-            return node
\ No newline at end of file
+            return node
@@ -3,12 +3,13 @@ DataForge framework is modular. The core of processor consists of basic funciona
 """
 
 from abc import abstractmethod, ABC, ABCMeta
+from importlib import import_module
 from types import ModuleType
 from typing import Optional, Any, TypeVar, Union, Type
 
 from core import Named
 from meta import Meta
-from task import Task
+from task import Task, declared, declare
 from typing import List
 T = TypeVar("T")
 
@@ -54,6 +55,10 @@ class ProxyTask(Task[T]):
     def specification(self):
         return self._task.specification
 
+    @property
+    def is_coroutine(self) -> bool:
+        return self._task.is_coroutine
+
     def check_by_meta(self, meta: Meta):
         self._task.check_by_meta(meta)
 
@@ -73,23 +78,27 @@ class IWorkspace(ABC, Named):
     def workspaces(self) -> set["IWorkspace"]:
         pass
 
-    @classmethod
+    #bumped by invalidate_index, makes every built index stale
+    _index_generation = 0
+
+    @staticmethod
+    def invalidate_index():
+        #called on every change of the tasks/workspaces of local workspaces; call it after
+        #changing a workspace whose tasks or workspaces properties build their own containers
+        IWorkspace._index_generation += 1
+
+    def _task_index(self) -> "_TaskIndex":
+        token = (IWorkspace._index_generation, len(self.tasks), len(self.workspaces))
+        #vars(): a Workspace class must not see the index of its base class
+        index = vars(self).get('_stem_task_index')
+        if index is None or index.token != token:
+            index = _TaskIndex(self, token)
+            #setattr works for LocalWorkspace instances and Workspace classes alike
+            setattr(self, '_stem_task_index', index)
+        return index
+
     def find_task(self, task_path: Union[str, TaskPath]) -> Optional[Task]:
-        if not isinstance(task_path, TaskPath):
-            task_path = TaskPath(task_path)
-        if not task_path.is_leaf:
-            for w in cls.workspaces:
-                if w.name == task_path.head:
-                    return w.find_task(task_path.sub_path)
-            return None
-        else:
-            for task_name in cls.tasks:
-                if task_name == task_path.name:
-                    return cls.tasks[task_name]
-            for w in cls.workspaces:
-                if (t := w.find_task(task_path)) is not None:
-                    return t
-            return None   
+        return self._task_index().find(str(task_path))
 
     def has_task(self, task_path: Union[str, TaskPath]) -> bool:
         return self.find_task(task_path) is not None
@@ -112,28 +121,159 @@ class IWorkspace(ABC, Named):
         if hasattr(task, '_stem_workspace') and task._stem_workspace != NotImplemented:
             return task._stem_workspace
         else:
-            module = import_module(task.__module__)
+            #decorated tasks are defined in the module of their function
+            func = getattr(task, '_func', None)
+            module = import_module(getattr(func, '__module__', None) or task.__module__)
             return IWorkspace.module_workspace(module)
 
     @staticmethod
     def module_workspace(module: ModuleType) -> "IWorkspace":
-        try:
-            return module.__stem_workspace #check if attribute exists
-        except AttributeError:
-        
-            tasks = {}
-            workspaces = set()
-            
-            for attr in dir(module):
-                a = getattr(module, attr)
-                if isinstance(a, Taks): #if Task
+        """
+        Workspace of the tasks and workspaces defined in a module.
+        Tasks made by @data/@task and Workspace classes are taken from the declaration
+        registry; other Task/IWorkspace values are found by a scan of the module dict
+        (no dir()/getattr(), so lazy module attributes are not triggered).
+        A module with __stem_lazy__ = True is described by its declarations only.
+        Nested workspaces can be given as module names ('pkg.module') in the
+        workspaces of a Workspace class or LocalWorkspace; they are imported on first lookup.
+        """
+        namespace = vars(module)
+        #module dict, not getattr: a module __getattr__ must not answer for it
+        if (workspace := namespace.get('__stem_workspace__')) is not None:
+            return workspace
+
+        tasks = {}
+        workspaces = set()
+
+        for attr, a in declared.get(module.__name__, {}).items():
+            if namespace.get(attr) is not a:
+                continue
+            if isinstance(a, Task):
+                tasks[attr] = a
+            else:
+                workspaces.add(a)
+
+        if not namespace.get('__stem_lazy__', False):
+            for attr, a in list(namespace.items()):
+                if attr in tasks or attr.startswith('__'):
+                    continue
+                if isinstance(a, Task): #if Task
                     tasks[attr] = a
-                if isinstance(a, type) and issubclass(a, IWorkspace):
+                #mro check: ABC isinstance fails on the Workspace metaclass subclass
+                elif IWorkspace in type(a).__mro__:
                     workspaces.add(a)
-                    
-            #creating workspace
-            module.__stem_workspace = create_workspace(module.__name__, tasks, workspace)
-            return module.__stem_workspace
+                
+        #creating workspace
+        module.__stem_workspace__ = LocalWorkspace(module.__name__, tasks, workspaces)
+        return module.__stem_workspace__
+
+
+class _TaskIndex:
+    """
+    Lookup tables of a workspace. A bare name resolves to the nearest definition: own tasks
+    first, then nested workspaces by nesting depth, then by workspace name. A path 'a.b.t'
+    goes through the nested workspaces a and b and resolves t there as a bare name.
+    Every resolved path is remembered, so repeated lookups are a single dict hit.
+    Indexes are rebuilt after any change of the tasks or workspaces of a local workspace,
+    so lookups in parents see changes of nested workspaces.
+    """
+
+    def __init__(self, workspace: IWorkspace, token: tuple):
+        self.token = token
+        self.workspace = workspace
+        self.children = {}
+        for w in workspace.workspaces:
+            self.children[w.name] = w
+        self.resolved: dict[str, Optional[Task]] = {}
+        self._bare: Optional[dict[str, tuple[int, Task]]] = None
+
+    @property
+    def bare(self) -> dict[str, tuple[int, Task]]:
+        #name -> (nesting depth, task) of the nearest definition in the subtree
+        if self._bare is None:
+            bare = {name: (0, task) for name, task in self.workspace.tasks.items()}
+            for name in sorted(self.children):
+                for task_name, (depth, task) in self.children[name]._task_index().bare.items():
+                    if task_name not in bare or depth + 1 < bare[task_name][0]:
+                        bare[task_name] = (depth + 1, task)
+            self._bare = bare
+        return self._bare
+
+    def find(self, path: str) -> Optional[Task]:
+        try:
+            return self.resolved[path]
+        except KeyError:
+            pass
+
+        *heads, name = path.split('.')
+        index = self
+        for head in heads:
+            workspace = index.children.get(head)
+            if workspace is None:
+                task = None
+                break
+            index = workspace._task_index()
+        else:
+            #own tasks win, nested (possibly not yet imported) workspaces are not touched
+            task = index.workspace.tasks.get(name)
+            if task is None:
+                found = index.bare.get(name)
+                task = None if found is None else found[1]
+
+        self.resolved[path] = task
+        return task
+
+
+class LazyWorkspace(IWorkspace):
+    #nested workspace of a module, imported when a lookup or structure() reaches it
+    def __init__(self, module_name: str, name: Optional[str] = None):
+        self.module_name = module_name
+        self._name = module_name.rsplit('.', 1)[-1] if name is None else name
+        self._workspace: Optional[IWorkspace] = None
+
+    @property
+    def workspace(self) -> IWorkspace:
+        if self._workspace is None:
+            self._workspace = IWorkspace.module_workspace(import_module(self.module_name))
+        return self._workspace
+
+    @property
+    def tasks(self) -> dict[str, Task]:
+        return self.workspace.tasks
+
+    @property
+    def workspaces(self) -> set["IWorkspace"]:
+        return self.workspace.workspaces
+
+
+def _invalidating(method):
+    def mutate(self, *args, **kwargs):
+        IWorkspace.invalidate_index()
+        return method(self, *args, **kwargs)
+    mutate.__name__ = method.__name__
+    return mutate
+
+
+class _TaskDict(dict):
+    #tasks of a local workspace: a change makes the indexes of it and of its parents stale
+    pass
+
+
+class _WorkspaceSet(set):
+    #nested workspaces of a local workspace, see _TaskDict
+    pass
+
+
+for _name in ('__setitem__', '__delitem__', '__ior__', 'pop', 'popitem', 'clear', 'update', 'setdefault'):
+    setattr(_TaskDict, _name, _invalidating(getattr(dict, _name)))
+for _name in ('__ior__', '__iand__', '__isub__', '__ixor__', 'add', 'discard', 'remove', 'pop', 'clear',
+              'update', 'difference_update', 'intersection_update', 'symmetric_difference_update'):
+    setattr(_WorkspaceSet, _name, _invalidating(getattr(set, _name)))
+del _name
+
+
+def _nested_workspaces(workspaces) -> set[IWorkspace]:
+    return _WorkspaceSet(LazyWorkspace(w) if isinstance(w, str) else w for w in workspaces)
 
 
 class ILocalWorkspace(IWorkspace):
@@ -151,24 +291,23 @@ class LocalWorkspace(ILocalWorkspace):
 
     def __init__(self, name,  tasks=(), workspaces=()):
         self._name = name
-        self._tasks = tasks
-        self._workspaces = workspaces
+        self._tasks = _TaskDict(tasks)
+        self._workspaces = _nested_workspaces(workspaces)
 
 
 class Workspace(ABCMeta, ILocalWorkspace):
     def __new__(mcls: type["Workspace"], name: str, bases: tuple[type, ...], namespace: dict[str, Any], **kwargs: Any) -> Type[IWorkspace]:
 
-        if IWorkspace not in bases:
-            bases += (IWorkspace,)
-
+        #the class itself is an instance of IWorkspace (through the metaclass),
+        #so IWorkspace is not added to its bases: methods are bound to the class
         cls: Type[IWorkspace] = super().__new__(mcls, name, bases, namespace, **kwargs)  
 
-        cls.name = name
+        cls._name = name
 
         try:
-            cls.workspaces = set(cls.workspaces)
+            cls._workspaces = _nested_workspaces(namespace.get('workspaces', ()))
         except TypeError:
-            cls.workspaces = set()
+            cls._workspaces = _WorkspaceSet()
 
         for s, t in cls.__dict__.items():
             if isinstance(t, Task):
@@ -177,15 +316,15 @@ class Workspace(ABCMeta, ILocalWorkspace):
                     setattr(cls, s, t)
                 t._stem_workspace = cls  
 
-        cls.tasks = {
-            s: t
+        cls._tasks = _TaskDict(
+            (s, t)
             for s, t in cls.__dict__.items()
             if isinstance(t, Task)
-        }
+        )
 
         def __new(userclass, *args, **kwargs):
             return userclass
 
         cls.__new__ = __new  
 
-        return cls
+        return declare(cls, cls.__module__, cls.__qualname__)
@@ -1,8 +1,20 @@
 import zipfile
-import h5py
-import numpy as np
 
-def read_zip_print_hdf5(input_path, output_path, header_size=24, size_of_innermost_array=1024, dtype='float32', dataset_name='_'):
+#bytes of a subfile read and written in one step
+BLOCK_SIZE = 64*1024*1024 # 64 Mb
+#target size of an HDF5 chunk
+CHUNK_SIZE = 1024*1024 # 1 Mb
+
+def read_zip_print_hdf5(input_path, output_path, header_size=24, size_of_innermost_array=1024, dtype='float32', dataset_name='_',
+                        block_size=BLOCK_SIZE, chunk_size=CHUNK_SIZE):
+    #h5py and numpy are heavy, they are loaded only when a conversion runs
+    import h5py
+    import numpy as np
+
+    #record of a subfile: header followed by the entry, headers are skipped by the strided payload view
+    record = np.dtype([('header', f'V{header_size}'), ('payload', dtype, (size_of_innermost_array,))]) \
+        if header_size > 0 else np.dtype([('payload', dtype, (size_of_innermost_array,))])
+
     with zipfile.ZipFile(input_path) as input_file:
 
         nstreams = len(input_file.namelist())
@@ -10,12 +22,18 @@ def read_zip_print_hdf5(input_path, output_path, header_size=24, size_of_innermo
         entry_size = size_of_innermost_array * np.dtype(dtype).itemsize
         N_entries = subfile_size // (entry_size + header_size)
         assert N_entries * (entry_size + header_size) == subfile_size
+        assert record.itemsize == entry_size + header_size
+
+        #channels are written one at a time: a chunk holds consecutive entries of one channel
+        chunk_entries = max(1, min(N_entries, chunk_size // entry_size))
+        block_entries = max(chunk_entries, block_size // record.itemsize // chunk_entries * chunk_entries)
 
         with h5py.File(output_path, 'w') as output_file:
-            dataset = output_file.create_dataset(dataset_name, (N_entries, nstreams, size_of_innermost_array), dtype)
+            dataset = output_file.create_dataset(dataset_name, (N_entries, nstreams, size_of_innermost_array), dtype,
+                                                 chunks=(chunk_entries, 1, size_of_innermost_array) if N_entries else None)
             for channel_no, filename in enumerate(input_file.namelist()):
                 with input_file.open(filename) as subfile:
-                    for entry_no in range(N_entries):
-                        subfile.seek(header_size, 1)
-                        entry = np.frombuffer(subfile.read(entry_size), dtype)
-                        dataset[entry_no, channel_no, :] = entry
\ No newline at end of file
+                    for start in range(0, N_entries, block_entries):
+                        stop = min(start + block_entries, N_entries)
+                        block = np.frombuffer(subfile.read((stop - start) * record.itemsize), record)
+                        dataset[start:stop, channel_no, :] = block['payload']
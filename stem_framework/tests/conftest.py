@@ -0,0 +1,6 @@
+import sys
+from pathlib import Path
+
+#modules of stem import each other by bare names, codecs (envelope, compression) are imported from the package
+root = Path(__file__).resolve().parent.parent
+sys.path[:0] = [str(root / 'stem'), str(root)]
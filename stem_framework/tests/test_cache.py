@@ -0,0 +1,35 @@
+import operator
+import threading
+
+from task import data, MapTask, ReduceTask
+from task_cache import ResultCache, code_digest
+from task_master import TaskMaster
+from workspace import LocalWorkspace
+
+
+@data
+def src(meta):
+    return [1, 2, 3, 4]
+
+
+def test_cache_key_follows_the_callable(tmp_path):
+    workspace = LocalWorkspace('ws', {'src': src}, set())
+    add = ReduceTask(operator.add, 'src')
+    mul = ReduceTask(operator.mul, 'src')
+    assert TaskMaster(cache=ResultCache(tmp_path)).execute({}, add, workspace).data == 10
+    assert TaskMaster(cache=ResultCache(tmp_path)).execute({}, mul, workspace).data == 24
+
+
+def test_cache_key_follows_the_closure():
+    def scaled(k):
+        return MapTask(lambda x: x * k, 'src')
+    assert code_digest(scaled(2)) != code_digest(scaled(3))
+    assert code_digest(scaled(2)) == code_digest(scaled(2))
+
+
+def test_unhashable_closure_is_not_cached(tmp_path):
+    lock = threading.Lock()
+    task = MapTask(lambda x: lock and x, 'src')
+    workspace = LocalWorkspace('ws', {'src': src}, set())
+    assert code_digest(task) is None
+    assert list(TaskMaster(cache=ResultCache(tmp_path)).execute({}, task, workspace).data) == [1, 2, 3, 4]
@@ -0,0 +1,15 @@
+import pytest
+
+from stem.envelope import Envelope
+
+
+def test_shuffle_wider_than_chunk():
+    data = b'x' * 1000 + b'yz'
+    envelope = Envelope.read(Envelope({}, data, 'zlib', shuffle=200, chunk_size=100).to_bytes())
+    assert bytes(envelope.data) == data
+    assert envelope.chunk_size == 200
+
+
+def test_chunk_size_must_be_positive():
+    with pytest.raises(ValueError):
+        Envelope({}, b'x', 'zlib', chunk_size=0)
@@ -0,0 +1,21 @@
+from operator import add
+
+from task import data, MapTask, ReduceTask
+from task_master import TaskMaster
+from workspace import LocalWorkspace
+
+
+def test_streaming_results_are_not_reused():
+    @data
+    def src(meta):
+        return list(range(10))
+
+    double = MapTask(lambda x: 2 * x, 'src')
+    total = ReduceTask(add, double, 0)
+    workspace = LocalWorkspace('ws', {'src': src, 'map_src': double}, set())
+    task_master = TaskMaster(incremental=True)
+
+    assert task_master.execute({}, total, workspace).data == 90
+    #only the meta of reduce changes: the exhausted generator of map must not be reused
+    assert task_master.execute({'run': 2}, total, workspace).data == 90
+    assert [node.task.name for node in task_master.recomputed] == ['map_src', 'reduce_map_src']
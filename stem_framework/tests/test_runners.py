@@ -0,0 +1,95 @@
+import time
+
+import pytest
+
+from task import data, task, FunctionTask, MapTask
+from task_master import TaskMaster
+from task_runner import SimpleRunner, ParallelRunner, AsyncRunner
+from workspace import LocalWorkspace
+
+RUNNERS = [
+    lambda: SimpleRunner(),
+    lambda: SimpleRunner(memoize=True),
+    lambda: ParallelRunner(4),
+    lambda: ParallelRunner(2, processes=True),
+    lambda: AsyncRunner(),
+]
+
+
+@data
+def src(meta):
+    return list(range(200))
+
+
+def double(x):
+    #releases the GIL, so dependents in different threads read the stream at the same time
+    time.sleep(0.0001)
+    return 2 * x
+
+
+map_src = MapTask(double, 'src', chunk_size=10)
+
+
+@task
+def s1(meta, map_src):
+    return sum(map_src)
+
+
+@task
+def s2(meta, map_src):
+    return len(list(map_src))
+
+
+@task
+def top(meta, s1, s2):
+    return s1, s2
+
+
+@pytest.mark.parametrize('make_runner', RUNNERS)
+def test_fan_out_iterator(make_runner):
+    #both dependents of the map stream read all of it, under every runner
+    workspace = LocalWorkspace('ws', {'src': src, 'map_src': map_src, 's1': s1, 's2': s2}, set())
+    for _ in range(5):
+        assert TaskMaster(make_runner()).execute({}, top, workspace).data == (39800, 200)
+
+
+def test_computations_saved():
+    #a -> (b, c) -> d -> e: the non-memoized run transforms d twice and e four times
+    transforms = []
+
+    def node(name, *dependencies):
+        def transform(meta, **kwargs):
+            transforms.append(name)
+            return name
+        return FunctionTask(name, transform, dependencies)
+
+    tasks = {'e': node('e'), 'd': node('d', 'e'), 'b': node('b', 'd'), 'c': node('c', 'd')}
+    a = node('a', 'b', 'c')
+    workspace = LocalWorkspace('ws', tasks, set())
+
+    TaskMaster(SimpleRunner()).execute({}, a, workspace).data
+    plain = len(transforms)
+    transforms.clear()
+    runner = SimpleRunner(memoize=True)
+    TaskMaster(runner).execute({}, a, workspace).data
+    assert (plain, len(transforms)) == (7, 5)
+    assert runner.computations_saved == plain - len(transforms)
+
+
+def slow(meta, **kwargs):
+    time.sleep(0.05)
+    return 1
+
+
+@pytest.mark.parametrize('make_runner', RUNNERS)
+def test_wait_time(make_runner):
+    #e -> d -> a: a call waits for the work on its dependency subtree, the same under every runner
+    from task_profiler import Profiler
+    tasks = {'e': FunctionTask('e', slow, ()), 'd': FunctionTask('d', slow, ('e',))}
+    a = FunctionTask('a', slow, ('d',))
+    profiler = Profiler()
+    TaskMaster(make_runner(), profiler=profiler).execute({}, a, LocalWorkspace('ws', tasks, set())).data
+    wait = {record.name: record.wait_time for record in profiler.records}
+    assert wait['ws.e'] < 0.05
+    assert wait['ws.d'] >= 0.05
+    assert wait['ws.a'] >= 0.1
@@ -0,0 +1,29 @@
+from task import data, task
+from task_master import TaskMaster
+from workspace import LocalWorkspace
+
+
+@data
+def x1(meta):
+    return 1
+
+
+@data
+def x2(meta):
+    return 2
+
+
+@task
+def y(meta, x):
+    return x * 10
+
+
+def test_plans_follow_workspace_changes():
+    inner = LocalWorkspace('inner', {'x': x1})
+    workspace = LocalWorkspace('ws', {'y': y}, [inner])
+    task_master = TaskMaster()
+    assert task_master.execute({}, y, workspace).data == 10
+    inner.tasks['x'] = x2
+    assert task_master.execute({}, y, workspace).data == 20
+    inner.tasks['x'] = x1
+    assert task_master.execute({}, y, workspace).data == 10